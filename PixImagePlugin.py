@@ -0,0 +1,113 @@
+# PixImagePlugin.py
+#
+# Lets Pillow open and save PIX files directly:
+#
+#     import PixImagePlugin
+#     img = Image.open("photo.pix")         # reads only the header
+#     img.thumbnail((256, 256))             # decodes on first use
+#     img.save("copy.pix", effort=5)        # tile_size=256 for a tiled file
+
+from PIL import Image, ImageFile
+from pix_codec import (
+    read_header, header_channels, write_header, read_tile_table_from, tile_boxes,
+    decode_pixels, pixels_to_image, clear_transparent, iter_pix_rows, MODES,
+    TILED,
+)
+
+
+def _accept(prefix):
+    return prefix[:2] == b"PX"
+
+
+def make_tile(decoder, extents, offset, args):
+    if hasattr(ImageFile, "_Tile"):
+        return ImageFile._Tile(decoder, extents, offset, args)
+    return (decoder, extents, offset, args)
+
+
+class PixImageFile(ImageFile.ImageFile):
+    format = "PIX"
+    format_description = "PIX lossless image"
+
+    def _open(self):
+        header = read_header(self.fp)
+        width, height = header["width"], header["height"]
+        channels = header_channels(header)
+        self._mode = MODES[channels]
+        self._size = (width, height)
+        self.info["compression"] = header["compression"]
+        if header["effort"] is not None:
+            self.info["effort"] = header["effort"]
+        data_start = self.fp.tell()
+
+        if header["compression"] == TILED:
+            # Every PIX tile becomes a Pillow tile, so a tiled file decodes
+            # one tile at a time straight into its place.
+            tile_w, tile_h, entries, base = read_tile_table_from(self.fp)
+            boxes = tile_boxes(width, height, tile_w, tile_h)
+            if len(boxes) != len(entries):
+                raise SyntaxError("Tile table does not match the image size")
+            self.tile = [make_tile("pix_tile", (x, y, x + tw, y + th), data_start + base + offset, (t, size, channels))
+                         for (x, y, tw, th), (t, offset, size) in zip(boxes, entries)]
+        else:
+            self.tile = [make_tile("pix", (0, 0, width, height), data_start, (header,))]
+
+
+class PixDecoder(ImageFile.PyDecoder):
+    """Decodes a whole PIX stream into the image band by band."""
+    _pulls_fd = True
+
+    def decode(self, buffer):
+        header = self.args[0]
+        row_bytes = header["width"] * header_channels(header)
+        top, rows_left = self.state.yoff, self.state.ysize
+        y = top
+        for band in iter_pix_rows(self.fd, header):
+            rows = min(len(band) // row_bytes if row_bytes else rows_left, rows_left)
+            if rows <= 0:
+                break
+            self.state.yoff, self.state.ysize = y, rows
+            self.set_as_raw(band[:rows * row_bytes])
+            y += rows
+            rows_left -= rows
+        self.state.yoff, self.state.ysize = top, y - top + rows_left
+        return -1, 0
+
+
+class PixTileDecoder(ImageFile.PyDecoder):
+    """Decodes one tile of a tiled PIX file."""
+    _pulls_fd = True
+
+    def decode(self, buffer):
+        t, size, channels = self.args
+        tw, th = self.state.xsize, self.state.ysize
+        data = self.fd.read(size)
+        raw = decode_pixels(t, data, tw, th, channels)
+        self.set_as_raw(pixels_to_image(raw, tw, th, channels).tobytes())
+        return -1, 0
+
+
+def _save(im, fp, filename):
+    from to_pix import normalize_image, encode_pixels, color_count, PALETTE_LIMITS, EFFORT_LEVELS, MAX_EFFORT
+    effort = im.encoderinfo.get("effort", MAX_EFFORT)
+    if effort not in EFFORT_LEVELS:
+        raise ValueError(f"effort must be between 0 and {MAX_EFFORT}")
+    tile_size = im.encoderinfo.get("tile_size")
+    img, use_alpha = normalize_image(im)
+    w, h = img.size
+    c = len(img.getbands())
+    methods, _, _, top_k = EFFORT_LEVELS[effort]
+    colors = color_count(img) if any(m in PALETTE_LIMITS for m in methods) else None
+    best = encode_pixels(clear_transparent(img.tobytes(), c), w, h, c, methods, effort, "auto", top_k, False, tile_size, colors)
+    if best is None:
+        raise OSError("No PIX compression method succeeded")
+    _, t, payload, _ = best
+    write_header(fp, w, h, t, use_alpha, effort, c < 3)
+    fp.write(payload)
+
+
+Image.register_open(PixImageFile.format, PixImageFile, _accept)
+Image.register_save(PixImageFile.format, _save)
+Image.register_extension(PixImageFile.format, ".pix")
+Image.register_decoder("pix", PixDecoder)
+Image.register_decoder("pix_tile", PixTileDecoder)
@@ -0,0 +1,233 @@
+import sys
+import os
+import glob
+import json
+import hashlib
+import contextlib
+import io
+import multiprocessing
+import pix_codec
+from to_pix import save_pix, EFFORT_LEVELS, MAX_EFFORT
+from from_pix import convert_pix
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+MANIFEST_FILE = ".pix_manifest.json"
+HASH_CHUNK = 1 << 20
+
+
+def find_sources(inputs, direction):
+    """Expand directories and globs into a sorted list of source files."""
+    extensions = (".pix",) if direction == "from" else IMAGE_EXTENSIONS
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in files:
+                    if name.lower().endswith(extensions):
+                        found.add(os.path.join(root, name))
+        else:
+            for path in glob.glob(item, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(extensions):
+                    found.add(path)
+    return sorted(found)
+
+
+def output_path(source, direction, out_dir, fmt):
+    # Same naming as the .bat wrappers: photo.png -> photo.png.pix
+    name = source + (".pix" if direction == "to" else "." + fmt)
+    if out_dir is None:
+        return name
+    rel = os.path.relpath(name)
+    if rel.startswith(os.pardir):
+        rel = os.path.basename(name)
+    return os.path.join(out_dir, rel)
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def is_unchanged(entry, source, output, settings):
+    """Check a manifest entry against the source file.
+
+    The mtime and size are compared first; the file is only hashed when
+    they moved. Returns (unchanged, hash or None).
+    """
+    if entry is None or entry.get("settings") != settings or entry.get("output") != output:
+        return False, None
+    if not os.path.exists(output):
+        return False, None
+    st = os.stat(source)
+    if entry.get("mtime") == st.st_mtime_ns and entry.get("size") == st.st_size:
+        return True, entry.get("hash")
+    if entry.get("size") != st.st_size:
+        return False, None
+    digest = file_hash(source)
+    return digest == entry.get("hash"), digest
+
+
+def init_worker():
+    # The batch pool already uses every core, so tiled files decode inline.
+    pix_codec.PARALLEL_DECODE = False
+
+
+def convert_one(job):
+    """Convert one file. Errors are returned, not raised, so one bad file
+    does not stop the batch."""
+    direction, source, output, effort, top_k, check_prediction = job
+    try:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        log = io.StringIO()
+        stats = None
+        with contextlib.redirect_stdout(log):
+            if direction == "to":
+                # The batch pool already uses every core.
+                stats = save_pix(source, output, executor="inline", top_k=top_k,
+                                 check_prediction=check_prediction, effort=effort)
+            else:
+                convert_pix(source, output)
+        if not os.path.exists(output):
+            return source, output, log.getvalue().strip() or "no output written", None
+        return source, output, None, (stats or {}).get("prediction")
+    except Exception as e:
+        return source, output, f"{type(e).__name__}: {e}", None
+
+
+def run_batch(direction, inputs, out_dir=None, jobs=None, effort=MAX_EFFORT, fmt="png", manifest_path=MANIFEST_FILE, force=False, top_k=None, check_prediction=False):
+    sources = find_sources(inputs, direction)
+    manifest = load_manifest(manifest_path)
+    settings = f"{direction}:{effort}" if direction == "to" else f"{direction}:{fmt}"
+    if direction == "to" and top_k is not None:
+        settings += f":top{top_k}"
+    if direction == "to" and check_prediction:
+        # Checking keeps the exhaustive winner, so it changes the output too.
+        settings += ":check"
+
+    pending = []
+    skipped = 0
+    for source in sources:
+        output = output_path(source, direction, out_dir, fmt)
+        key = os.path.abspath(source)
+        unchanged, digest = (False, None) if force else is_unchanged(manifest.get(key), source, output, settings)
+        if unchanged:
+            st = os.stat(source)
+            manifest[key].update(mtime=st.st_mtime_ns, hash=digest)
+            skipped += 1
+        else:
+            pending.append((direction, source, output, effort, top_k, check_prediction))
+
+    print(f"{len(sources)} files, {skipped} unchanged, {len(pending)} to convert")
+    failed = 0
+    prediction = {"checked": 0, "missed": 0, "bytes_lost": 0}
+    if pending:
+        jobs = jobs or os.cpu_count() or 1
+        if jobs > 1 and len(pending) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(pending)), initializer=init_worker)
+            results = pool.imap_unordered(convert_one, pending)
+        else:
+            pool = None
+            results = map(convert_one, pending)
+        try:
+            for done, (source, output, error, outcome) in enumerate(results, 1):
+                if error:
+                    failed += 1
+                    print(f"[{done}/{len(pending)}] FAILED {source}: {error}")
+                    continue
+                if outcome is not None:
+                    prediction["checked"] += 1
+                    if not outcome["hit"]:
+                        prediction["missed"] += 1
+                        prediction["bytes_lost"] += outcome["bytes_lost"]
+                st = os.stat(source)
+                manifest[os.path.abspath(source)] = {
+                    "mtime": st.st_mtime_ns,
+                    "size": st.st_size,
+                    "hash": file_hash(source),
+                    "output": output,
+                    "settings": settings,
+                }
+                print(f"[{done}/{len(pending)}] {source} -> {output}")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            save_manifest(manifest_path, manifest)
+    elif sources:
+        save_manifest(manifest_path, manifest)
+
+    print(f"Done: {len(pending) - failed} converted, {skipped} skipped, {failed} failed")
+    if prediction["checked"]:
+        rate = prediction["missed"] / prediction["checked"] * 100
+        print(f"Prediction: {prediction['checked']} checked, {prediction['missed']} missed ({rate:.1f}%), "
+              f"{prediction['bytes_lost']:,} bytes lost")
+    return failed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("to", "from"):
+        print("Usage: python batch_pix.py to|from PATH_OR_GLOB... [--out DIR] [--jobs N] [--effort 0-9] [--top-k K] [--check-prediction] [--format EXT] [--manifest FILE] [--force]")
+        sys.exit(1)
+
+    direction = sys.argv[1]
+    args = sys.argv[2:]
+    options = {}
+    inputs = []
+    i = 0
+    while i < len(args):
+        if args[i] in ("--force", "--check-prediction"):
+            options[args[i][2:]] = True
+        elif args[i] in ("--out", "--jobs", "--effort", "--top-k", "--format", "--manifest"):
+            if i + 1 >= len(args):
+                print(f"Error: {args[i]} requires a value")
+                sys.exit(1)
+            options[args[i][2:]] = args[i + 1]
+            i += 1
+        else:
+            inputs.append(args[i])
+        i += 1
+
+    if not inputs:
+        print("Error: no input paths given")
+        sys.exit(1)
+    if "jobs" in options and (not options["jobs"].isdigit() or int(options["jobs"]) < 1):
+        print("Error: --jobs requires a positive number")
+        sys.exit(1)
+    if "effort" in options and (not options["effort"].isdigit() or int(options["effort"]) not in EFFORT_LEVELS):
+        print(f"Error: --effort must be between 0 and {MAX_EFFORT}")
+        sys.exit(1)
+    if "top-k" in options and (not options["top-k"].isdigit() or int(options["top-k"]) < 1):
+        print("Error: --top-k requires a positive number")
+        sys.exit(1)
+
+    failed = run_batch(
+        direction,
+        inputs,
+        out_dir=options.get("out"),
+        jobs=int(options["jobs"]) if "jobs" in options else None,
+        effort=int(options.get("effort", MAX_EFFORT)),
+        fmt=options.get("format", "png").lstrip("."),
+        manifest_path=options.get("manifest", MANIFEST_FILE),
+        force=options.get("force", False),
+        top_k=int(options["top-k"]) if "top-k" in options else None,
+        check_prediction=options.get("check-prediction", False),
+    )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,275 @@
+import sys
+import os
+import json
+import time
+import platform
+import tracemalloc
+import zlib
+import numpy as np
+from PIL import Image
+from to_pix import compress_worker, ALL_METHODS, EFFORT_LEVELS, MAX_EFFORT
+from pix_codec import decode_pixels
+
+DEFAULT_SIZES = (64, 256, 512)
+SEED = 1234
+# Throughput drops beyond this percentage are reported by --compare.
+DEFAULT_THRESHOLD = 10.0
+
+
+def make_flat(rng, size):
+    return np.full((size, size, 3), rng.randint(0, 256, 3), dtype=np.uint8)
+
+
+def make_gradient(rng, size):
+    y, x = np.mgrid[0:size, 0:size]
+    img = np.empty((size, size, 3), dtype=np.uint8)
+    img[:, :, 0] = x * 255 // max(size - 1, 1)
+    img[:, :, 1] = y * 255 // max(size - 1, 1)
+    img[:, :, 2] = (x + y) * 255 // max(2 * size - 2, 1)
+    return img
+
+
+def make_noise(rng, size):
+    return rng.randint(0, 256, (size, size, 3)).astype(np.uint8)
+
+
+def make_ui(rng, size):
+    """Flat panels, a title bar and rows of text-like glyph noise."""
+    img = np.full((size, size, 3), 240, dtype=np.uint8)
+    bar = max(size // 16, 2)
+    img[:bar] = (45, 90, 160)
+    for _ in range(max(size // 32, 2)):
+        x0, y0 = rng.randint(0, size, 2)
+        x1, y1 = x0 + rng.randint(4, size // 2 + 5), y0 + rng.randint(4, size // 4 + 5)
+        img[y0:y1, x0:x1] = rng.choice([200, 255, 225], 3)
+    line = max(size // 24, 4)
+    for y in range(bar + line, size - line, line * 2):
+        text = rng.rand(line // 2, size - 2 * line) < 0.3
+        img[y:y + line // 2, line:size - line][text] = (20, 20, 20)
+    return img
+
+
+def make_lowcolor(rng, size):
+    """Pixel art: a 16-color palette upscaled in 4x4 blocks."""
+    palette = rng.randint(0, 256, (16, 3)).astype(np.uint8)
+    cells = rng.randint(0, 16, ((size + 3) // 4, (size + 3) // 4))
+    return palette[np.kron(cells, np.ones((4, 4), dtype=int))[:size, :size]]
+
+
+def make_sprites(rng, size):
+    """RGBA: transparent background with soft-edged opaque blobs."""
+    img = np.zeros((size, size, 4), dtype=np.uint8)
+    y, x = np.mgrid[0:size, 0:size]
+    for _ in range(max(size // 32, 3)):
+        cx, cy = rng.randint(0, size, 2)
+        r = rng.randint(max(size // 16, 2), max(size // 6, 3))
+        dist = np.hypot(x - cx, y - cy)
+        inside = dist < r
+        img[inside, :3] = rng.randint(0, 256, 3)
+        img[inside, 3] = np.clip((r - dist[inside]) * 64, 0, 255).astype(np.uint8)
+    return img
+
+
+CORPUS = {
+    "flat": make_flat,
+    "gradient": make_gradient,
+    "noise": make_noise,
+    "ui": make_ui,
+    "lowcolor": make_lowcolor,
+    "sprites": make_sprites,
+}
+
+
+def make_corpus(names, sizes, seed=SEED):
+    """Yield (name, size, pixels) with the same pixels on every run."""
+    for name in names:
+        for size in sizes:
+            yield name, size, CORPUS[name](np.random.RandomState(seed), size)
+
+
+def timed(func, repeat):
+    """Best wall time over repeat runs, and the last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_image(name, pixels, methods, effort, repeat, memory=True):
+    h, w, c = pixels.shape
+    data = pixels.tobytes()
+    mb = len(data) / 1e6
+    results = []
+    for method in methods:
+        task = (method, data, (w, h, c, effort))
+        entry = {"image": name, "width": w, "height": h, "channels": c, "method": method}
+        encode_s, (size, t, payload, _) = timed(lambda: compress_worker(task), repeat)
+        if size == float("inf"):
+            entry["error"] = "method not applicable"
+            results.append(entry)
+            continue
+        try:
+            decode_s, decoded = timed(lambda: decode_pixels(t, payload, w, h, c), repeat)
+            roundtrip = bytes(decoded) == data
+        except Exception as e:
+            decode_s, roundtrip = None, False
+            entry["error"] = f"decode failed: {type(e).__name__}: {e}"
+        entry.update({
+            "type": t,
+            "bytes": size,
+            "ratio": len(data) / size if size else None,
+            "roundtrip": roundtrip,
+            "encode_s": encode_s,
+            "encode_mb_s": mb / encode_s if encode_s else None,
+            "encode_px_s": w * h / encode_s if encode_s else None,
+        })
+        if decode_s is not None:
+            entry.update({
+                "decode_s": decode_s,
+                "decode_mb_s": mb / decode_s if decode_s else None,
+                "decode_px_s": w * h / decode_s if decode_s else None,
+            })
+        if memory:
+            # Measured in separate runs so tracing does not skew the timings.
+            entry["encode_peak_bytes"] = peak_memory(lambda: compress_worker(task))
+            if decode_s is not None:
+                entry["decode_peak_bytes"] = peak_memory(lambda: decode_pixels(t, payload, w, h, c))
+        results.append(entry)
+    return results
+
+
+def run_bench(names=tuple(CORPUS), sizes=DEFAULT_SIZES, methods=ALL_METHODS, effort=MAX_EFFORT, repeat=3, memory=True):
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pillow": Image.__version__,
+            "zlib": zlib.ZLIB_RUNTIME_VERSION,
+            "cpus": os.cpu_count(),
+            "effort": effort,
+            "repeat": repeat,
+            "seed": SEED,
+        },
+        "results": [],
+    }
+    for name, size, pixels in make_corpus(names, sizes):
+        print(f"Benchmarking {name} {size}x{size}...", file=sys.stderr)
+        report["results"].extend(bench_image(name, pixels, methods, effort, repeat, memory))
+    return report
+
+
+def compare_reports(old, new, threshold=DEFAULT_THRESHOLD):
+    """List regressions from old to new: throughput drops beyond threshold
+    percent, larger output, and round trips that stopped working."""
+    key = lambda e: (e["image"], e["width"], e["height"], e["method"])
+    before = {key(e): e for e in old["results"]}
+    regressions = []
+    for entry in new["results"]:
+        prev = before.get(key(entry))
+        if prev is None or "bytes" not in prev:
+            continue
+        label = f"{entry['image']} {entry['width']}x{entry['height']} {entry['method']}"
+        if "bytes" not in entry:
+            regressions.append(f"{label}: no longer produces output ({entry.get('error')})")
+            continue
+        if prev.get("roundtrip") and not entry.get("roundtrip"):
+            regressions.append(f"{label}: round trip no longer matches")
+        if entry["bytes"] > prev["bytes"]:
+            regressions.append(f"{label}: size {prev['bytes']:,} -> {entry['bytes']:,} bytes")
+        for stage in ("encode", "decode"):
+            was, now = prev.get(f"{stage}_mb_s"), entry.get(f"{stage}_mb_s")
+            if was and now and now < was * (1 - threshold / 100):
+                regressions.append(f"{label}: {stage} {was:.2f} -> {now:.2f} MB/s ({(now / was - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def parse_list(value):
+    return [v for v in value.split(",") if v]
+
+
+if __name__ == "__main__":
+    usage = ("Usage: python bench_pix.py [--sizes 64,256,512] [--images NAMES] [--methods NAMES] "
+             "[--effort 0-9] [--repeat N] [--no-memory] [--out results.json]\n"
+             "       python bench_pix.py --compare old.json new.json [--threshold PERCENT]")
+    args = sys.argv[1:]
+    if "--help" in args:
+        print(usage)
+        sys.exit(0)
+
+    def option(name, default=None):
+        if name not in args:
+            return default
+        idx = args.index(name)
+        if idx + 1 >= len(args):
+            print(f"Error: {name} requires a value")
+            sys.exit(1)
+        return args[idx + 1]
+
+    try:
+        threshold = float(option("--threshold", DEFAULT_THRESHOLD))
+    except ValueError:
+        print("Error: --threshold requires a number")
+        sys.exit(1)
+
+    if "--compare" in args:
+        idx = args.index("--compare")
+        if idx + 2 >= len(args):
+            print(usage)
+            sys.exit(1)
+        with open(args[idx + 1]) as f:
+            old = json.load(f)
+        with open(args[idx + 2]) as f:
+            new = json.load(f)
+        regressions = compare_reports(old, new, threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"{len(regressions)} regressions")
+        sys.exit(1 if regressions else 0)
+
+    sizes = option("--sizes")
+    if sizes is not None and not all(s.isdigit() and int(s) > 0 for s in parse_list(sizes)):
+        print("Error: --sizes requires positive numbers separated by commas")
+        sys.exit(1)
+    names = parse_list(option("--images", ",".join(CORPUS)))
+    methods = parse_list(option("--methods", ",".join(ALL_METHODS)))
+    for value, known, kind in ((names, CORPUS, "image"), (methods, ALL_METHODS, "method")):
+        unknown = [v for v in value if v not in known]
+        if unknown:
+            print(f"Error: unknown {kind} {', '.join(unknown)}; choose from {', '.join(known)}")
+            sys.exit(1)
+    effort = option("--effort", str(MAX_EFFORT))
+    if not effort.isdigit() or int(effort) not in EFFORT_LEVELS:
+        print(f"Error: --effort must be between 0 and {MAX_EFFORT}")
+        sys.exit(1)
+    repeat = option("--repeat", "3")
+    if not repeat.isdigit() or int(repeat) < 1:
+        print("Error: --repeat requires a positive number")
+        sys.exit(1)
+
+    report = run_bench(
+        names,
+        [int(s) for s in parse_list(sizes)] if sizes else DEFAULT_SIZES,
+        methods,
+        int(effort),
+        int(repeat),
+        "--no-memory" not in args,
+    )
+    out = option("--out")
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Saved: {out}")
+    else:
+        print(json.dumps(report, indent=1))
@@ -1,119 +1,89 @@
 # editor_pix.py
 
-import sys, os, subprocess, tempfile, time, zlib
+import sys, os, subprocess, tempfile, time
+from pix_codec import (
+    read_header, header_channels, write_header, decode_pixels, tile_boxes,
+    pixels_to_image, clear_transparent, TILED,
+)
 from from_pix import load_pix
-from to_pix import save_pix
+from to_pix import save_pix, splice_tiles, is_gray, MAX_EFFORT
 from PIL import Image
+import numpy as np
 
-def png_filter_encode_fast(pixel_bytes, width, height, channels):
-    filtered_data = bytearray()
-    bytes_per_row = width * channels
-    for row in range(height):
-        row_start = row * bytes_per_row
-        row_data = pixel_bytes[row_start:row_start + bytes_per_row]
-        
-        if row == 0:
-            filtered_row = bytearray([0]) + row_data
-        else:
-            prev_row_start = (row - 1) * bytes_per_row
-            prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-            up_filtered = bytearray([2])
-            for i in range(len(row_data)):
-                pred = prev_row[i]
-                up_filtered.append((row_data[i] - pred) % 256)
-            filtered_row = up_filtered
-        
-        filtered_data.extend(filtered_row)
-    
-    return zlib.compress(filtered_data, level=6)
+# Effort used for --fast saves: zlib level 3, Up filter only.
+FAST_EFFORT = 2
 
-def png_filter_decode_fast(compressed_data, width, height, channels):
-    filtered_data = zlib.decompress(compressed_data)
-    pixel_bytes = bytearray()
-    bytes_per_row = width * channels
-    pos = 0
-    
-    for row in range(height):
-        filter_type = filtered_data[pos]
-        pos += 1
-        row_data = filtered_data[pos:pos+bytes_per_row]
-        pos += bytes_per_row
-        
-        if filter_type == 0:  
-            reconstructed = row_data
-        elif filter_type == 2 and row > 0: 
-            prev_row_start = (row-1)*bytes_per_row
-            prev_row = pixel_bytes[prev_row_start:prev_row_start+bytes_per_row]
-            reconstructed = bytearray()
-            for i in range(len(row_data)):
-                up = prev_row[i]
-                reconstructed.append((row_data[i]+up)%256)
-        else:
-            reconstructed = row_data
-        
-        pixel_bytes.extend(reconstructed)
-    
-    return pixel_bytes
+# Tiled files are patched in place while at most this share of tiles changed.
+SPLICE_MAX_FRACTION = 0.25
 
 def fast_load_pix(filename):
     with open(filename, "rb") as f:
-        if f.read(2) != b"PX":
-            raise ValueError("Not a valid .pix file")
-        width = int.from_bytes(f.read(2), "little")
-        height = int.from_bytes(f.read(2), "little")
-        flags = f.read(1)[0]
-        compression = flags & 0x0F
-        has_alpha = bool(flags & 0x10)
-        channels = 4 if has_alpha else 3
+        header = read_header(f)
+        width = header["width"]
+        height = header["height"]
+        compression = header["compression"]
+        channels = header_channels(header)
         compressed_data = f.read()
     
-    pixels = []
-    
-    if compression == 0: 
-        raw_bytes = compressed_data
-    elif compression == 2: 
-        raw_bytes = zlib.decompress(compressed_data)
-    elif compression == 6: 
-        raw_bytes = png_filter_decode_fast(compressed_data, width, height, channels)
-    else:
-        raise ValueError(f"Unsupported fast compression type: {compression}")
-
-    for i in range(0, len(raw_bytes), channels):
-        pixel_tuple = tuple(raw_bytes[i:i+channels])
-        if not has_alpha:
-            pixel_tuple += (255,)
-        pixels.append(pixel_tuple)
-
-    img = Image.new("RGBA", (width, height))
-    img.putdata(pixels)
-    return img
-
-def fast_save_pix(png_file, pix_file):
-    img = Image.open(png_file).convert("RGBA")
-    width, height = img.size
-    pixels = list(img.getdata())
-    use_alpha = any(a!=255 for r,g,b,a in pixels)
-    channels = 4 if use_alpha else 3
-    
-    data = bytearray()
-    for r,g,b,a in pixels:
-        data.extend([r,g,b] + ([a] if use_alpha else []))
-    
-    methods = [
-        (len(data), 0, data),
-        (len(zlib.compress(data, level=6)), 2, zlib.compress(data, level=6)),
-        (len(png_filter_encode_fast(data, width, height, channels)), 6, png_filter_encode_fast(data, width, height, channels))
-    ]
-    
-    chosen_size, t, chosen_data = min(methods, key=lambda x: x[0])
-    
-    with open(pix_file, "wb") as f:
-        f.write(b"PX")
-        f.write(width.to_bytes(2, "little"))
-        f.write(height.to_bytes(2, "little"))
-        flags = t | (0x08 if use_alpha else 0x00)
-        f.write(bytes([flags]))
-        f.write(chosen_data)
+    raw_bytes = decode_pixels(compression, compressed_data, width, height, channels)
+    return pixels_to_image(raw_bytes, width, height, channels)
+
+def fast_save_pix(png_file, pix_file, tile_size=None):
+    save_pix(png_file, pix_file, effort=FAST_EFFORT, tile_size=tile_size)
+
+def pix_tile_size(pix_file):
+    """Tile size of a tiled file, None for any other layout."""
+    with open(pix_file, "rb") as f:
+        header = read_header(f)
+        if header["compression"] != TILED:
+            return None
+        return int.from_bytes(f.read(2), "little")
+
+def save_edits(original, png_file, pix_file, effort=None):
+    """Write only what the edit changed.
+
+    Returns True if the file is already up to date: nothing changed, or the
+    changed tiles of a tiled file were re-encoded and spliced in. Returns
+    False when a full encode is needed.
+    """
+    old = np.asarray(original.convert("RGBA"))
+    new = np.asarray(Image.open(png_file).convert("RGBA"))
+    if old.shape != new.shape:
+        return False
+    changed = (old != new).any(axis=2)
+    if not changed.any():
+        print("No changes made, keeping the original file")
+        return True
+
+    with open(pix_file, "rb") as f:
+        header = read_header(f)
+        payload = f.read()
+    use_alpha = bool(new[:, :, 3].min() != 255)
+    gray = is_gray(new)
+    if header["compression"] != TILED or use_alpha != header["has_alpha"] or gray != header["gray"]:
+        return False
+    tile_w = int.from_bytes(payload[0:2], "little")
+    tile_h = int.from_bytes(payload[2:4], "little")
+    if tile_w != tile_h:
+        return False
+    boxes = tile_boxes(header["width"], header["height"], tile_w)
+    dirty = {i for i, (x, y, tw, th) in enumerate(boxes) if changed[y:y + th, x:x + tw].any()}
+    if len(dirty) > SPLICE_MAX_FRACTION * len(boxes):
+        return False
+
+    if effort is None:
+        effort = header["effort"] if header["effort"] is not None else MAX_EFFORT
+    c = header_channels(header)
+    bands = ([0] if gray else [0, 1, 2]) + ([3] if use_alpha else [])
+    data = clear_transparent(new[:, :, bands].tobytes(), c)
+    payload = splice_tiles(payload, data, header["width"], header["height"], c, dirty, effort)
+    tmp_pix = pix_file + ".tmp"
+    with open(tmp_pix, "wb") as f:
+        write_header(f, header["width"], header["height"], TILED, use_alpha, effort, gray)
+        f.write(payload)
+    os.replace(tmp_pix, pix_file)
+    print(f"Re-encoded {len(dirty)} of {len(boxes)} tiles")
+    return True
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -177,15 +147,19 @@ if __name__ == '__main__':
     print("Converting back to pix...")
     save_start = time.time()
 
-    if fast_mode:
+    # Tiled files stay tiled so later edits can be spliced too.
+    tile_size = pix_tile_size(pix_file)
+    if save_edits(img, tmp_png, pix_file, FAST_EFFORT if fast_mode else None):
+        print(f"Saved in {time.time()-save_start:.2f}s")
+    elif fast_mode:
         try:
-            fast_save_pix(tmp_png, pix_file)
+            fast_save_pix(tmp_png, pix_file, tile_size)
             print(f"Fast save completed in {time.time()-save_start:.2f}s")
         except Exception as e:
             print(f"Fast save failed: {e}. Using full compression...")
-            save_pix(tmp_png, pix_file)
+            save_pix(tmp_png, pix_file, tile_size=tile_size)
     else:
-        save_pix(tmp_png, pix_file)
+        save_pix(tmp_png, pix_file, tile_size=tile_size)
 
     try:
         os.remove(tmp_png)
@@ -1,323 +1,195 @@
 # Convert from PIX to PNG
 
-from PIL import Image
+import numpy as np
 import sys, zlib
+from pix_codec import (
+    read_header, decode_pixels, filter_rows, png_unfilter, read_tile_table_from,
+    tile_boxes, place_tile, pixels_to_image, pixels_to_array, header_channels,
+    convert_pixels, fit_pixels, iter_pix_rows, MODES, READ_CHUNK, RAW, ZLIB,
+    ZLIB_STRATEGY, PNG_ROW, PNG_ALL, PNG_ROW_ZLIB, PNG_ALL_ZLIB, TILED,
+)
 
-def run_length_decode(data, channels, pixel_count):
-    """Decode RLE data back to pixels"""
-    result = bytearray()
-    i = 0
-    pixels_decoded = 0
-    
-    while i < len(data) and pixels_decoded < pixel_count:
-        run_length = data[i]
-        i += 1
-        pixel_data = data[i:i+channels]
-        i += channels
-        
-        for _ in range(run_length):
-            result.extend(pixel_data)
-            pixels_decoded += 1
-            if pixels_decoded >= pixel_count:
-                break
-    
-    return result
 
-def predictive_decode(data, channels, width, height, method_hint="simple_delta"):
-    pixel_count = width * height
-    result = bytearray()
-    
-    if method_hint == "simple_delta":
-        prev = tuple([0] * channels)
-        for i in range(0, len(data), channels):
-            deltas = data[i:i+channels]
-            current = tuple((deltas[j] + prev[j]) % 256 for j in range(channels))
-            result.extend(current)
-            prev = current
-    
-    elif method_hint == "avg_prediction":
-        for i in range(0, len(data), channels):
-            current_data = data[i:i+channels]
-            if i == 0:
-                result.extend(current_data)
-            else:
-                prev = result[i-channels:i]
-                decoded = [(current_data[j] + prev[j]) % 256 for j in range(channels)]
-                result.extend(decoded)
-    
-    elif method_hint.startswith("paeth"):
-        for i in range(0, len(data), channels):
-            current_data = data[i:i+channels]
-            pixel_index = i // channels
-            row = pixel_index // width
-            col = pixel_index % width
-            
-            if row == 0 and col == 0:
-                result.extend(current_data)
-            elif row == 0:
-                left_start = (pixel_index - 1) * channels
-                left = result[left_start:left_start+channels]
-                decoded = [(current_data[j] + left[j]) % 256 for j in range(channels)]
-                result.extend(decoded)
-            elif col == 0:
-                above_start = (pixel_index - width) * channels
-                above = result[above_start:above_start+channels]
-                decoded = [(current_data[j] + above[j]) % 256 for j in range(channels)]
-                result.extend(decoded)
-            else:
-                left_start = (pixel_index - 1) * channels
-                above_start = (pixel_index - width) * channels
-                left = result[left_start:left_start+channels]
-                above = result[above_start:above_start+channels]
-                decoded = [(current_data[j] + ((left[j] + above[j]) // 2)) % 256 for j in range(channels)]
-                result.extend(decoded)
-    
-    else:
-        return predictive_decode(data, channels, width, height, "simple_delta")
-    
-    return result
-
-def png_filter_decode(compressed_data, width, height, channels):
-    filtered_data = zlib.decompress(compressed_data)
-    
-    pixel_bytes = bytearray()
-    bytes_per_row = width * channels
-    filtered_pos = 0
-    
-    for row in range(height):
-        if filtered_pos >= len(filtered_data):
-            break
-            
-        filter_type = filtered_data[filtered_pos]
-        filtered_pos += 1
-        
-        row_data = filtered_data[filtered_pos:filtered_pos + bytes_per_row]
-        filtered_pos += bytes_per_row
-        
-        if len(row_data) < bytes_per_row:
-            row_data = row_data + bytearray([0] * (bytes_per_row - len(row_data)))
-        
-        reconstructed_row = bytearray()
-        
-        if filter_type == 0:  
-            reconstructed_row = row_data
-            
-        elif filter_type == 1:  
-            for i in range(len(row_data)):
-                if i < channels:
-                    reconstructed_row.append(row_data[i])
-                else:
-                    left = reconstructed_row[i - channels]
-                    reconstructed_row.append((row_data[i] + left) % 256)
-                    
-        elif filter_type == 2:  
-            if row > 0:
-                prev_row_start = (row - 1) * bytes_per_row
-                prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-                for i in range(len(row_data)):
-                    up = prev_row[i] if i < len(prev_row) else 0
-                    reconstructed_row.append((row_data[i] + up) % 256)
-            else:
-                reconstructed_row = row_data
-                
-        elif filter_type == 3: 
-            prev_row = bytearray()
-            if row > 0:
-                prev_row_start = (row - 1) * bytes_per_row
-                prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-                
-            for i in range(len(row_data)):
-                left = reconstructed_row[i - channels] if i >= channels else 0
-                up = prev_row[i] if i < len(prev_row) else 0
-                avg = (left + up) // 2
-                reconstructed_row.append((row_data[i] + avg) % 256)
-                
-        elif filter_type == 4:  
-            prev_row = bytearray()
-            if row > 0:
-                prev_row_start = (row - 1) * bytes_per_row
-                prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-                
-            for i in range(len(row_data)):
-                left = reconstructed_row[i - channels] if i >= channels else 0
-                up = prev_row[i] if i < len(prev_row) else 0
-                up_left = prev_row[i - channels] if i >= channels and i < len(prev_row) else 0
-                
-                p = left + up - up_left
-                pa = abs(p - left)
-                pb = abs(p - up)
-                pc = abs(p - up_left)
-                
-                if pa <= pb and pa <= pc:
-                    pred = left
-                elif pb <= pc:
-                    pred = up
-                else:
-                    pred = up_left
-                    
-                reconstructed_row.append((row_data[i] + pred) % 256)
-        else:
-            reconstructed_row = row_data
-        
-        pixel_bytes.extend(reconstructed_row)
-    
-    return pixel_bytes
-
-def load_pix(filename):
+def load_pix(filename, mode=None):
+    """Load a PIX file as an image in its stored mode (L, LA, RGB or RGBA),
+    or converted to mode if given."""
     with open(filename, "rb") as f:
-        magic = f.read(2)
-        if magic != b"PX":
-            raise ValueError("Not a pix file")
-
-        width = int.from_bytes(f.read(2), "little")
-        height = int.from_bytes(f.read(2), "little")
-        flags = f.read(1)[0]
-        
-        compression = flags & 0x0F  
-        has_alpha = bool(flags & 0x10)  
-        channels = 4 if has_alpha else 3
-        pixel_count = width * height
+        header = read_header(f)
+        width = header["width"]
+        height = header["height"]
+        compression = header["compression"]
+        channels = header_channels(header)
 
-        print(f"Loading: {width}x{height}, {'RGBA' if has_alpha else 'RGB'}, compression={compression}")
+        effort = f", effort={header['effort']}" if header["effort"] is not None else ""
+        print(f"Loading: {width}x{height}, {MODES[channels]}, compression={compression}{effort}")
 
         compressed_data = f.read()
-        pixels = []
-
-        if compression == 0: 
-            for i in range(0, len(compressed_data), channels):
-                if has_alpha:
-                    r, g, b, a = compressed_data[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = compressed_data[i:i+3]
-                    pixels.append((r, g, b, 255))
-
-        elif compression == 1:  
-            decompressed = zlib.decompress(compressed_data)
-            raw_bytes = run_length_decode(decompressed, channels, pixel_count)
-            
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
 
-        elif compression in [2, 3]:  
-            raw_bytes = zlib.decompress(compressed_data)
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
+    raw_bytes = decode_pixels(compression, compressed_data, width, height, channels)
+    out_channels = output_channels(mode, channels)
+    raw_bytes = convert_pixels(fit_pixels(raw_bytes, width, height, channels), channels, out_channels)
+    return pixels_to_image(raw_bytes, width, height, out_channels)
 
-        elif compression == 4:  
-            decompressed = zlib.decompress(compressed_data)
-            raw_bytes = predictive_decode(decompressed, channels, width, height, "simple_delta")
-            
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
 
-        elif compression == 5:  
-            decompressed = zlib.decompress(compressed_data)
-            palette_size = decompressed[0]
-            palette_bytes_size = palette_size * channels
-            
-            palette = []
-            for i in range(palette_size):
-                start = 1 + i * channels
-                if has_alpha:
-                    r, g, b, a = decompressed[start:start+4]
-                    palette.append((r, g, b, a))
-                else:
-                    r, g, b = decompressed[start:start+3]
-                    palette.append((r, g, b, 255))
-            
-            indices_start = 1 + palette_bytes_size
-            for i in range(indices_start, len(decompressed)):
-                if i - indices_start < pixel_count:
-                    palette_index = decompressed[i]
-                    if palette_index < len(palette):
-                        pixels.append(palette[palette_index])
+def output_channels(mode, channels):
+    if mode is None:
+        return channels
+    for c, name in MODES.items():
+        if name == mode:
+            return c
+    raise ValueError(f"Unsupported mode {mode}; use one of {', '.join(MODES.values())}")
 
-        elif compression == 6:  
-            raw_bytes = png_filter_decode(compressed_data, width, height, channels)
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
-
-        elif compression == 7:  
-            raw_bytes = png_filter_decode(compressed_data, width, height, channels)
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
-
-        elif compression == 8:  
-            rle_data = png_filter_decode(compressed_data, width, height, channels)
-            raw_bytes = run_length_decode(rle_data, channels, pixel_count)
-            
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
-
-        elif compression == 9:   
-            png_compressed = zlib.decompress(compressed_data)
-            raw_bytes = png_filter_decode(png_compressed, width, height, channels)
-            
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
-
-        elif compression == 10:  
-            png_compressed = zlib.decompress(compressed_data)
-            raw_bytes = png_filter_decode(png_compressed, width, height, channels)
-            
-            for i in range(0, len(raw_bytes), channels):
-                if has_alpha:
-                    r, g, b, a = raw_bytes[i:i+4]
-                    pixels.append((r, g, b, a))
-                else:
-                    r, g, b = raw_bytes[i:i+3]
-                    pixels.append((r, g, b, 255))
 
+def load_pix_array(filename, channels=None):
+    """Decode a PIX file into an (H, W, C) uint8 array. C is the channel
+    count stored in the file (1 to 4) unless channels asks for another one.
+    The array is backed by the decoded buffer itself."""
+    with open(filename, "rb") as f:
+        header = read_header(f)
+        compressed_data = f.read()
+    width, height = header["width"], header["height"]
+    stored = header_channels(header)
+    raw_bytes = decode_pixels(header["compression"], compressed_data, width, height, stored)
+    if channels is not None and channels != stored:
+        raw_bytes = convert_pixels(fit_pixels(raw_bytes, width, height, stored), stored, channels)
+        stored = channels
+    return pixels_to_array(raw_bytes, width, height, stored)
+
+
+def inflate_prefix(f, size, layers=1):
+    """Decompress from f only until size bytes of output are available.
+
+    layers=2 handles the streams that were zlib-compressed twice.
+    """
+    decoders = [zlib.decompressobj() for _ in range(layers)]
+    out = bytearray()
+    while len(out) < size:
+        chunk = f.read(READ_CHUNK)
+        if not chunk:
+            break
+        for d in decoders:
+            chunk = d.decompress(chunk)
+        out += chunk
+    return out[:size]
+
+def load_pix_region(filename, box):
+    """Decode only what is needed for box = (left, upper, right, lower).
+
+    Tiled files read and decode just the tiles under the box, raw files read
+    just the rows it spans, and zlib and PNG-filtered streams stop
+    decompressing after its last row. The other types are decoded in full
+    and cropped.
+    """
+    with open(filename, "rb") as f:
+        header = read_header(f)
+        width = header["width"]
+        height = header["height"]
+        compression = header["compression"]
+        channels = header_channels(header)
+        data_start = f.tell()
+
+        left, upper, right, lower = box
+        left, right = max(0, left), min(width, right)
+        upper, lower = max(0, upper), min(height, lower)
+        if left >= right or upper >= lower:
+            raise ValueError(f"Region {box} is outside the {width}x{height} image")
+        region_w = right - left
+        row_bytes = width * channels
+        region = np.zeros((lower - upper, region_w * channels), dtype=np.uint8)
+
+        if compression == TILED:
+            tile_w, tile_h, entries, base = read_tile_table_from(f)
+            boxes = tile_boxes(width, height, tile_w, tile_h)
+            if len(boxes) != len(entries):
+                raise ValueError("Tile table does not match the image size")
+            for (x, y, tw, th), (t, offset, size) in zip(boxes, entries):
+                if x >= right or x + tw <= left or y >= lower or y + th <= upper:
+                    continue
+                f.seek(data_start + base + offset)
+                tile = np.zeros((th, tw * channels), dtype=np.uint8)
+                place_tile(tile, (0, 0, tw, th), t, f.read(size), channels)
+                x0, x1 = max(x, left), min(x + tw, right)
+                y0, y1 = max(y, upper), min(y + th, lower)
+                region[y0 - upper:y1 - upper, (x0 - left) * channels:(x1 - left) * channels] = \
+                    tile[y0 - y:y1 - y, (x0 - x) * channels:(x1 - x) * channels]
         else:
-            raise ValueError(f"Unsupported compression type: {compression}")
-
-    while len(pixels) < pixel_count:
-        pixels.append((0, 0, 0, 255))  
-    pixels = pixels[:pixel_count]
-
-    img = Image.new("RGBA", (width, height))
-    img.putdata(pixels)
-    return img
+            if compression == RAW:
+                rows = bytearray()
+                for row in range(upper, lower):
+                    f.seek(data_start + row * row_bytes + left * channels)
+                    rows += f.read(region_w * channels).ljust(region_w * channels, b"\0")
+                full = None
+                region[:] = np.frombuffer(rows, dtype=np.uint8).reshape(region.shape)
+            elif compression in (ZLIB, ZLIB_STRATEGY):
+                full = inflate_prefix(f, lower * row_bytes)
+            elif compression in (PNG_ROW, PNG_ALL):
+                full = png_unfilter(inflate_prefix(f, lower * (row_bytes + 1)), width, lower, channels)
+            elif compression in (PNG_ROW_ZLIB, PNG_ALL_ZLIB):
+                full = png_unfilter(inflate_prefix(f, lower * (row_bytes + 1), layers=2), width, lower, channels)
+            else:
+                full = decode_pixels(compression, f.read(), width, height, channels)
+            if full is not None:
+                rows = np.zeros(lower * row_bytes, dtype=np.uint8)
+                n = min(len(full), len(rows))
+                rows[:n] = np.frombuffer(full, dtype=np.uint8, count=n)
+                region[:] = rows.reshape(lower, row_bytes)[upper:, left * channels:right * channels]
+
+    return pixels_to_image(region.tobytes(), region_w, lower - upper, channels)
+
+
+def png_chunk(out, kind, data):
+    out.write(len(data).to_bytes(4, "big"))
+    out.write(kind)
+    out.write(data)
+    out.write(zlib.crc32(data, zlib.crc32(kind)).to_bytes(4, "big"))
+
+# PNG color type for each channel count.
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+def write_png_stream(out, width, height, channels, bands):
+    """Write row bands as an 8-bit gray or color PNG, with or without alpha,
+    without holding the image.
+
+    Each row gets the PNG filter with the smallest sum of absolute signed
+    residuals.
+    """
+    row_bytes = width * channels
+    out.write(b"\x89PNG\r\n\x1a\n")
+    png_chunk(out, b"IHDR", width.to_bytes(4, "big") + height.to_bytes(4, "big")
+              + bytes([8, PNG_COLOR_TYPES[channels], 0, 0, 0]))
+    compressor = zlib.compressobj(level=6)
+    prev = np.zeros(row_bytes, dtype=np.uint8)
+    for band in bands:
+        rows = np.frombuffer(band, dtype=np.uint8).reshape(-1, row_bytes)
+        if not len(rows):
+            continue
+        filtered = filter_rows(rows, prev, channels)
+        cost = np.minimum(filtered, 256 - filtered.astype(np.int16)).sum(axis=2)
+        best = cost.argmin(axis=0)
+        block = np.empty((len(rows), row_bytes + 1), dtype=np.uint8)
+        block[:, 0] = best
+        block[:, 1:] = filtered[best, np.arange(len(rows))]
+        data = compressor.compress(block)
+        if data:
+            png_chunk(out, b"IDAT", data)
+        prev = rows[-1]
+    png_chunk(out, b"IDAT", compressor.flush())
+    png_chunk(out, b"IEND", b"")
+
+def convert_pix(input_file, output_file):
+    """Convert a PIX file, streaming rows straight into PNG output."""
+    if not output_file.lower().endswith(".png"):
+        load_pix(input_file).save(output_file)
+        return
+    with open(input_file, "rb") as f, open(output_file, "wb") as out:
+        header = read_header(f)
+        channels = header_channels(header)
+        effort = f", effort={header['effort']}" if header["effort"] is not None else ""
+        print(f"Loading: {header['width']}x{header['height']}, {MODES[channels]}, compression={header['compression']}{effort}")
+        write_png_stream(out, header["width"], header["height"], channels, iter_pix_rows(f, header))
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Usage: python from_pix.py input.pix output.png")
     else:
-        img = load_pix(sys.argv[1])
-        img.save(sys.argv[2])
\ No newline at end of file
+        convert_pix(sys.argv[1], sys.argv[2])
\ No newline at end of file
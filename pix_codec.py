@@ -0,0 +1,1276 @@
+# pix_codec.py
+#
+# The PIX format on the buffer level: header, compression type registry,
+# encoders and decoders. to_pix, from_pix, view_pix and editor_pix all go
+# through here.
+
+from PIL import Image
+import numpy as np
+import os
+import io
+import zlib
+import atexit
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Compression type IDs, stored in the low nibble of the header flags.
+RAW = 0
+RLE = 1
+ZLIB = 2
+ZLIB_STRATEGY = 3
+DELTA = 4
+PALETTE = 5
+PNG_ROW = 6
+PNG_ALL = 7
+RLE_PNG_ROW = 8
+PNG_ROW_ZLIB = 9
+PNG_ALL_ZLIB = 10
+TILED = 11
+RLE_VARINT = 12
+PALETTE_PACKED = 13
+
+# Set on a compression type when the alpha channel is stored as its own
+# plane (header flag 0x40); see split_alpha_decode.
+SPLIT_ALPHA = 0x40
+
+ALL_FILTERS = (0, 1, 2, 3, 4)
+FILTER_BLOCK_BYTES = 1 << 20
+
+HEADER_VERSION = 2
+LEGACY_MAX_DIM = 65535
+
+# Pillow mode for each stored channel count; 1 and 2 are gray and gray+alpha.
+MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+ZLIB_STRATEGIES = {
+    "zlib_default": zlib.Z_DEFAULT_STRATEGY,
+    "zlib_filtered": zlib.Z_FILTERED,
+    "zlib_huffman": zlib.Z_HUFFMAN_ONLY
+}
+
+
+def read_header(f):
+    """Read the PIX header and leave f at the start of the compressed data.
+
+    Files written before the extended header existed have no version or
+    effort; those come back as 0 and None. From version 2 the width and
+    height are 32-bit extended fields, so the 16-bit ones may be 0.
+    """
+    header = f.read(7)
+    if len(header) < 7 or header[:2] != b"PX":
+        raise ValueError("Not a pix file")
+    flags = header[6]
+    info = {
+        "width": int.from_bytes(header[2:4], "little"),
+        "height": int.from_bytes(header[4:6], "little"),
+        "compression": flags & (0x0F | SPLIT_ALPHA),
+        "has_alpha": bool(flags & 0x10),
+        "gray": bool(flags & 0x20),
+        "version": 0,
+        "effort": None,
+    }
+    if flags & 0x80:
+        ext = f.read(3)
+        if len(ext) < 3:
+            raise ValueError("Truncated pix header")
+        info["version"] = ext[0]
+        fields = f.read(int.from_bytes(ext[1:3], "little"))
+        if len(fields) >= 1:
+            info["effort"] = fields[0]
+        if info["version"] >= 2 and len(fields) >= 9:
+            info["width"] = int.from_bytes(fields[1:5], "little")
+            info["height"] = int.from_bytes(fields[5:9], "little")
+    return info
+
+
+def header_channels(header):
+    """Channels per pixel as stored: 1 to 4 for L, LA, RGB and RGBA."""
+    return (1 if header["gray"] else 3) + (1 if header["has_alpha"] else 0)
+
+
+def write_header(f, w, h, t, use_alpha, effort, gray=False):
+    f.write(b"PX")
+    # The legacy 16-bit fields are 0 when the image is too large for them;
+    # the real size is always in the extended fields.
+    legacy = w <= LEGACY_MAX_DIM and h <= LEGACY_MAX_DIM
+    f.write((w if legacy else 0).to_bytes(2, "little"))
+    f.write((h if legacy else 0).to_bytes(2, "little"))
+    flags = t | (0x10 if use_alpha else 0x00) | (0x20 if gray else 0x00) | 0x80
+    f.write(bytes([flags]))
+    # Extended header: version, field size, then the fields themselves.
+    fields = bytes([effort]) + w.to_bytes(4, "little") + h.to_bytes(4, "little")
+    f.write(bytes([HEADER_VERSION]))
+    f.write(len(fields).to_bytes(2, "little"))
+    f.write(fields)
+
+
+# Images up to this many pixels are compressed in the calling thread; starting
+# or feeding a pool costs more than the work itself.
+INLINE_MAX_PIXELS = 256 * 256
+
+# Tiled files are decoded on the process pool unless this is turned off, as
+# batch_pix does in its workers, which already keep every core busy.
+PARALLEL_DECODE = True
+
+pools = {}
+
+
+def get_pool(kind):
+    """Return the persistent thread or process pool, starting it on first use.
+
+    The process pool forks, so it is always started before the thread pool:
+    a fork taken while worker threads run can copy a lock one of them holds.
+    """
+    pool = pools.get(kind)
+    if pool is None:
+        if kind == "thread" and "process" not in pools and can_start_processes():
+            get_pool("process")
+        if kind == "process":
+            if os.name == "posix":
+                # Workers must share the parent's resource tracker, or each
+                # one starts its own and "cleans up" blocks it attached to.
+                resource_tracker.ensure_running()
+            pool = multiprocessing.Pool()
+        else:
+            pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        pools[kind] = pool
+    return pool
+
+
+def can_start_processes():
+    """False inside a daemonic worker (a multiprocessing.Pool worker, for
+    example), which is not allowed to start a pool of its own."""
+    return not multiprocessing.current_process().daemon
+
+
+def shutdown_pools():
+    for kind, pool in list(pools.items()):
+        if kind == "process":
+            pool.terminate()
+            pool.join()
+        else:
+            pool.shutdown()
+    pools.clear()
+
+
+atexit.register(shutdown_pools)
+
+
+def pixel_runs(buf, channels):
+    """Split a uint8 array of whole pixels into runs of equal pixels.
+
+    Returns the first pixel of every run as an (n, channels) array and the
+    run lengths.
+    """
+    px = buf.reshape(-1, channels)
+    if not len(px):
+        return px, np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.any(px[1:] != px[:-1], axis=1)) + 1))
+    return px[starts], np.diff(np.append(starts, len(px)))
+
+
+def rle_encode(data, channels):
+    """(count, pixel) records with counts up to 255; longer runs are split."""
+    if not data:
+        return bytearray()
+    buf = np.frombuffer(data, dtype=np.uint8)
+    whole = len(buf) - len(buf) % channels
+    pixels, lengths = pixel_runs(buf[:whole], channels)
+    per_run = -(-lengths // 255)
+    out = np.empty((int(per_run.sum()), 1 + channels), dtype=np.uint8)
+    out[:, 0] = 255
+    out[np.cumsum(per_run) - 1, 0] = lengths - 255 * (per_run - 1)
+    out[:, 1:] = np.repeat(pixels, per_run, axis=0)
+    result = bytearray(out)
+    if whole < len(buf):
+        # A trailing partial pixel is kept as a run of one.
+        result.append(1)
+        result.extend(buf[whole:].tobytes())
+    return result
+
+
+# Runs per block of the varint RLE stream. Each block is the run count and
+# the byte size of its run lengths (4 bytes each), the run lengths as
+# LEB128 varints, then one pixel per run.
+RLE_BLOCK_RUNS = 1 << 16
+RLE_BLOCK_HEAD = 8
+
+
+def varint_encode(values):
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= (1 << (7 * k))
+    ends = np.cumsum(sizes)
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        sel = sizes > k
+        more = np.where(sizes[sel] > k + 1, 0x80, 0)
+        out[ends[sel] - sizes[sel] + k] = ((values[sel] >> (7 * k)) & 0x7F) | more
+    return out
+
+
+def varint_decode(buf):
+    ends = np.flatnonzero(buf < 0x80)
+    if not len(ends):
+        return np.zeros(0, dtype=np.int64)
+    buf = buf[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = 7 * np.minimum(np.arange(len(buf)) - np.repeat(starts, ends - starts + 1), 9)
+    return np.add.reduceat((buf.astype(np.int64) & 0x7F) << shift, starts)
+
+
+def rle_varint_encode(data, channels):
+    """Run-length encode whole pixels with no cap on the run length."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    pixels, lengths = pixel_runs(buf[:len(buf) - len(buf) % channels], channels)
+    parts = []
+    for i in range(0, len(lengths), RLE_BLOCK_RUNS):
+        counts = varint_encode(lengths[i:i + RLE_BLOCK_RUNS])
+        run_count = min(RLE_BLOCK_RUNS, len(lengths) - i)
+        parts += [run_count.to_bytes(4, "little"), len(counts).to_bytes(4, "little"),
+                  counts.tobytes(), pixels[i:i + run_count].tobytes()]
+    return b"".join(parts)
+
+
+def rle_block_size(data, pos, channels):
+    """Total size of the varint RLE block at pos, header included."""
+    run_count = int.from_bytes(data[pos:pos + 4], "little")
+    return RLE_BLOCK_HEAD + int.from_bytes(data[pos + 4:pos + 8], "little") + run_count * channels
+
+
+def read_rle_block(data, pos, channels):
+    """Return (pixels, run lengths, end) of the varint RLE block at pos. A
+    block cut short keeps the runs it has whole pixels for."""
+    size = int.from_bytes(data[pos + 4:pos + 8], "little")
+    end = min(rle_block_size(data, pos, channels), len(data) - pos) + pos
+    pos += RLE_BLOCK_HEAD
+    counts = varint_decode(np.frombuffer(data, dtype=np.uint8, count=max(min(size, end - pos), 0), offset=pos))
+    pos += size
+    pixels = np.frombuffer(data, dtype=np.uint8, count=max(end - pos, 0) // channels * channels,
+                           offset=min(pos, len(data))).reshape(-1, channels)
+    n = min(len(counts), len(pixels))
+    return pixels[:n], counts[:n], end
+
+
+def expand_runs(pixels, counts, piece_pixels):
+    """Yield runs expanded in pieces of at most piece_pixels pixels, so one
+    long run never has to be held whole; it is split across pieces."""
+    ends = np.cumsum(counts, dtype=np.int64)
+    total = int(ends[-1]) if len(ends) else 0
+    for start in range(0, total, piece_pixels):
+        stop = min(start + piece_pixels, total)
+        first = int(np.searchsorted(ends, start, side="right"))
+        last = int(np.searchsorted(ends, stop - 1, side="right")) + 1
+        lengths = np.minimum(ends[first:last], stop) - np.maximum(ends[first:last] - counts[first:last], start)
+        yield np.repeat(pixels[first:last], lengths, axis=0).reshape(-1)
+
+
+def rle_varint_decode(data, channels, pixel_count=None):
+    """Expand varint RLE blocks, stopping after pixel_count pixels."""
+    limit = pixel_count * channels if pixel_count is not None else None
+    parts = []
+    done = 0
+    pos = 0
+    while pos + RLE_BLOCK_HEAD <= len(data) and (limit is None or done < limit):
+        pixels, counts, pos = read_rle_block(data, pos, channels)
+        block = np.repeat(pixels, counts, axis=0).reshape(-1)
+        if limit is not None:
+            block = block[:limit - done]
+        parts.append(block)
+        done += len(block)
+    return bytearray(np.concatenate(parts)) if parts else bytearray()
+
+
+def as_rows(data, width, height, channels):
+    row_bytes = width * channels
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) != row_bytes * height:
+        padded = np.zeros(row_bytes * height, dtype=np.uint8)
+        n = min(len(buf), len(padded))
+        padded[:n] = buf[:n]
+        buf = padded
+    return buf.reshape(height, row_bytes)
+
+
+def filter_rows(rows, prev, channels):
+    """Apply all five PNG-style filters to a block of rows.
+
+    rows is a (n, row_bytes) uint8 array and prev the row above the block
+    (zeros for the first row of the image). Returns a (5, n, row_bytes)
+    array holding the None, Sub, Up, Avg and Paeth filtered bytes.
+    """
+    n, row_bytes = rows.shape
+    up = np.empty_like(rows)
+    up[0] = prev
+    up[1:] = rows[:-1]
+    left = np.zeros_like(rows)
+    left[:, channels:] = rows[:, :-channels]
+    up_left = np.zeros_like(rows)
+    up_left[:, channels:] = up[:, :-channels]
+
+    out = np.empty((5, n, row_bytes), dtype=np.uint8)
+    out[0] = rows
+    np.subtract(rows, left, out=out[1])
+    np.subtract(rows, up, out=out[2])
+
+    left16 = left.astype(np.int16)
+    up16 = up.astype(np.int16)
+    up_left16 = up_left.astype(np.int16)
+    np.subtract(rows, ((left16 + up16) >> 1).astype(np.uint8), out=out[3])
+
+    pa = np.abs(up16 - up_left16)
+    pb = np.abs(left16 - up_left16)
+    pc = np.abs(left16 + up16 - 2 * up_left16)
+    pred = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+    np.subtract(rows, pred, out=out[4])
+    return out
+
+
+def iter_filter_blocks(rows, channels):
+    height, row_bytes = rows.shape
+    block = max(1, FILTER_BLOCK_BYTES // max(row_bytes, 1))
+    prev = np.zeros(row_bytes, dtype=np.uint8)
+    for start in range(0, height, block):
+        chunk = rows[start:start + block]
+        yield start, filter_rows(chunk, prev, channels)
+        prev = chunk[-1]
+
+
+def pick_row_filters(filtered, first_row, width, filters=ALL_FILTERS):
+    """Choose a filter for each row of a filter_rows block.
+
+    Returns the rows prefixed with their filter byte. first_row says whether
+    the block starts at the top of the image.
+    """
+    n = filtered.shape[1]
+    # Same heuristic as the per-row search: lowest sum(|b - 128|) wins,
+    # ties go to the earlier filter. Sub/Avg need width > 1, Up/Avg/Paeth
+    # need a previous row. A row with no usable filter left stays None.
+    cost = np.abs(filtered.astype(np.int16) - 128).sum(axis=2)
+    cost[[f for f in ALL_FILTERS if f not in filters]] = np.iinfo(cost.dtype).max
+    if width <= 1:
+        cost[1] = np.iinfo(cost.dtype).max
+        cost[3] = np.iinfo(cost.dtype).max
+    if first_row:
+        cost[2:, 0] = np.iinfo(cost.dtype).max
+    best = cost.argmin(axis=0)
+    block = np.empty((n, filtered.shape[2] + 1), dtype=np.uint8)
+    block[:, 0] = best
+    block[:, 1:] = filtered[best, np.arange(n)]
+    return block
+
+
+def png_filter(data, width, height, channels, level=9, filters=ALL_FILTERS):
+    rows = as_rows(data, width, height, channels)
+    compressor = zlib.compressobj(level=level)
+    out = []
+    for start, filtered in iter_filter_blocks(rows, channels):
+        block = pick_row_filters(filtered, start == 0, width, filters)
+        out.append(compressor.compress(block))
+    out.append(compressor.flush())
+    return b"".join(out)
+
+
+def png_filter_all(data, width, height, channels, level=9, filters=ALL_FILTERS):
+    rows = as_rows(data, width, height, channels)
+    names = ["PNG_none", "PNG_sub", "PNG_up", "PNG_avg", "PNG_paeth"]
+    compressors = {f: zlib.compressobj(level=level) for f in filters}
+    outputs = {f: [] for f in filters}
+    block = None
+    for _, filtered in iter_filter_blocks(rows, channels):
+        n, row_bytes = filtered.shape[1:]
+        if block is None or len(block) != n:
+            block = np.empty((n, row_bytes + 1), dtype=np.uint8)
+        for f in filters:
+            block[:, 0] = f
+            block[:, 1:] = filtered[f]
+            outputs[f].append(compressors[f].compress(block))
+    streams = {}
+    for f in filters:
+        outputs[f].append(compressors[f].flush())
+        streams[names[f]] = b"".join(outputs[f])
+    best = min(streams, key=lambda x: len(streams[x]))
+    return (len(streams[best]), PNG_ALL, streams[best], best)
+
+
+def palette_encode(data, width, height, channels, level=9):
+    """Return (payload, color count). The payload is None when the image
+    has more colors than the one-byte palette size can hold. The palette is
+    ordered by frequency."""
+    buf = np.frombuffer(data, dtype=np.uint8, count=width * height * channels)
+    keys, inverse, counts = np.unique(pack_pixels(buf, channels), return_inverse=True, return_counts=True)
+    unique = len(keys)
+    if unique > 255:
+        return None, unique
+    colors = ((keys[:, None] >> (8 * np.arange(channels, dtype=np.uint32))) & 0xFF).astype(np.uint8)
+    rank = np.argsort(-counts, kind="stable")
+    position = np.empty(unique, dtype=np.uint8)
+    position[rank] = np.arange(unique)
+    pal_data = bytes([unique]) + colors[rank].tobytes() + position[inverse.reshape(-1)].tobytes()
+    return zlib.compress(pal_data, level=level), unique
+
+
+# Palette orders tried by palette_packed_encode.
+PALETTE_ORDERS = ("frequency", "luminance")
+PALETTE_PACKED_MAX = 1 << 16
+
+
+def pack_pixels(buf, channels):
+    """One uint32 per pixel, channel 0 in the low byte."""
+    px = buf.reshape(-1, channels)
+    packed = np.zeros(len(px), dtype=np.uint32)
+    for i in range(channels):
+        packed |= px[:, i].astype(np.uint32) << (8 * i)
+    return packed
+
+
+def index_bits(colors):
+    for bits in (1, 2, 4, 8):
+        if colors <= 1 << bits:
+            return bits
+    return 16
+
+
+def packed_row_bytes(width, bits):
+    return (width * bits + 7) // 8
+
+
+def pack_indices(indices, bits):
+    """Pack an (H, W) index array row by row, MSB first, each row padded
+    to whole bytes. 16-bit indices are big-endian."""
+    if bits == 16:
+        return indices.astype(">u2").tobytes()
+    if bits == 8:
+        return indices.astype(np.uint8).tobytes()
+    per = 8 // bits
+    h, w = indices.shape
+    padded = np.zeros((h, -(-w // per) * per), dtype=np.uint8)
+    padded[:, :w] = indices
+    shifts = (8 - bits * (np.arange(per) + 1)).astype(np.uint8)
+    return np.bitwise_or.reduce(padded.reshape(h, -1, per) << shifts, axis=2).astype(np.uint8).tobytes()
+
+
+def unpack_indices(data, width, bits):
+    """Inverse of pack_indices for as many whole rows as data holds."""
+    row_bytes = packed_row_bytes(width, bits)
+    rows = len(data) // row_bytes if row_bytes else 0
+    buf = np.frombuffer(data, dtype=np.uint8, count=rows * row_bytes).reshape(rows, row_bytes)
+    if bits == 16:
+        return buf.view(">u2")
+    if bits == 8:
+        return buf
+    per = 8 // bits
+    shifts = (8 - bits * (np.arange(per) + 1)).astype(np.uint8)
+    return ((buf[:, :, None] >> shifts) & ((1 << bits) - 1)).reshape(rows, row_bytes * per)[:, :width]
+
+
+def palette_packed_encode(data, width, height, channels, level=9, orders=PALETTE_ORDERS):
+    """Return (payload, color count) for type 13, trying each palette order
+    and keeping the smallest. The payload is None above 65536 colors.
+
+    Layout before zlib: index bits (1, 2, 4, 8 or 16), color count - 1
+    (2 bytes), the palette, then the indices packed row by row.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8, count=width * height * channels)
+    keys, inverse, counts = np.unique(pack_pixels(buf, channels), return_inverse=True, return_counts=True)
+    if len(keys) > PALETTE_PACKED_MAX:
+        return None, len(keys)
+    colors = ((keys[:, None] >> (8 * np.arange(channels, dtype=np.uint32))) & 0xFF).astype(np.uint8)
+    bits = index_bits(len(keys))
+    best = None
+    for order in orders:
+        if order == "frequency":
+            rank = np.argsort(-counts, kind="stable")
+        else:
+            luma = colors[:, :3].astype(np.int64) @ np.array([299, 587, 114]) if channels >= 3 else colors[:, 0]
+            rank = np.lexsort((colors[:, -1], luma))
+        position = np.empty(len(keys), dtype=np.int64)
+        position[rank] = np.arange(len(keys))
+        indices = position[inverse.reshape(-1)].reshape(height, width)
+        payload = (bytes([bits]) + (len(keys) - 1).to_bytes(2, "little") + colors[rank].tobytes()
+                   + pack_indices(indices, bits))
+        comp = zlib.compress(payload, level)
+        if best is None or len(comp) < len(best):
+            best = comp
+    return best, len(keys)
+
+
+def palette_packed_header(decompressed, channels):
+    """Return (bits, palette array, index data offset) of a type 13 stream."""
+    bits = decompressed[0]
+    count = int.from_bytes(decompressed[1:3], "little") + 1
+    start = 3 + count * channels
+    palette = np.frombuffer(decompressed, dtype=np.uint8, count=count * channels, offset=3).reshape(count, channels)
+    return bits, palette, start
+
+
+def palette_packed_decode(decompressed, width, height, channels):
+    bits, palette, start = palette_packed_header(decompressed, channels)
+    indices = unpack_indices(memoryview(decompressed)[start:start + height * packed_row_bytes(width, bits)], width, bits)
+    # Out-of-range indices come out as the first color.
+    return bytearray(palette[np.where(indices < len(palette), indices, 0)])
+
+
+def run_length_decode(data, channels, pixel_count):
+    """Decode RLE data back to pixels"""
+    record = 1 + channels
+    recs = np.frombuffer(data, dtype=np.uint8, count=len(data) // record * record).reshape(-1, record)
+    counts = recs[:, 0]
+    # Only the records needed for pixel_count pixels are expanded.
+    needed = int(np.searchsorted(np.cumsum(counts, dtype=np.int64), pixel_count)) + 1
+    out = np.repeat(recs[:needed, 1:], counts[:needed], axis=0)[:pixel_count]
+    return bytearray(out)
+
+
+def predictive_decode(data, channels, width, height, method_hint="simple_delta"):
+    pixel_count = width * height
+    result = bytearray()
+    
+    if method_hint == "simple_delta":
+        prev = tuple([0] * channels)
+        for i in range(0, len(data), channels):
+            deltas = data[i:i+channels]
+            current = tuple((deltas[j] + prev[j]) % 256 for j in range(channels))
+            result.extend(current)
+            prev = current
+    
+    elif method_hint == "avg_prediction":
+        for i in range(0, len(data), channels):
+            current_data = data[i:i+channels]
+            if i == 0:
+                result.extend(current_data)
+            else:
+                prev = result[i-channels:i]
+                decoded = [(current_data[j] + prev[j]) % 256 for j in range(channels)]
+                result.extend(decoded)
+    
+    elif method_hint.startswith("paeth"):
+        for i in range(0, len(data), channels):
+            current_data = data[i:i+channels]
+            pixel_index = i // channels
+            row = pixel_index // width
+            col = pixel_index % width
+            
+            if row == 0 and col == 0:
+                result.extend(current_data)
+            elif row == 0:
+                left_start = (pixel_index - 1) * channels
+                left = result[left_start:left_start+channels]
+                decoded = [(current_data[j] + left[j]) % 256 for j in range(channels)]
+                result.extend(decoded)
+            elif col == 0:
+                above_start = (pixel_index - width) * channels
+                above = result[above_start:above_start+channels]
+                decoded = [(current_data[j] + above[j]) % 256 for j in range(channels)]
+                result.extend(decoded)
+            else:
+                left_start = (pixel_index - 1) * channels
+                above_start = (pixel_index - width) * channels
+                left = result[left_start:left_start+channels]
+                above = result[above_start:above_start+channels]
+                decoded = [(current_data[j] + ((left[j] + above[j]) // 2)) % 256 for j in range(channels)]
+                result.extend(decoded)
+    
+    else:
+        return predictive_decode(data, channels, width, height, "simple_delta")
+    
+    return result
+
+
+def avg_row(dst, start, raw, prev, channels):
+    end = start + len(raw)
+    for ch in range(channels):
+        left = 0
+        for i, r, u in zip(range(start + ch, end, channels), raw[ch::channels], prev[ch::channels]):
+            left = (r + ((left + u) >> 1)) & 255
+            dst[i] = left
+
+
+def paeth_row(dst, start, raw, prev, channels):
+    end = start + len(raw)
+    for ch in range(channels):
+        left = up_left = 0
+        for i, r, u in zip(range(start + ch, end, channels), raw[ch::channels], prev[ch::channels]):
+            pa = abs(u - up_left)
+            pb = abs(left - up_left)
+            pc = abs(left + u - 2 * up_left)
+            if pa <= pb and pa <= pc:
+                pred = left
+            elif pb <= pc:
+                pred = u
+            else:
+                pred = up_left
+            left = (r + pred) & 255
+            dst[i] = left
+            up_left = u
+
+
+def png_filter_decode(compressed_data, width, height, channels):
+    return png_unfilter(zlib.decompress(compressed_data), width, height, channels)
+
+
+def png_unfilter(filtered_data, width, height, channels, prev_row=None):
+    """Undo PNG-style filtering. prev_row is the reconstructed row above the
+    first one, for decoding a stream in pieces."""
+    bytes_per_row = width * channels
+    stride = bytes_per_row + 1
+
+    # Rows whose filter byte is missing are dropped, a truncated last row is
+    # zero-padded.
+    rows = min(height, -(-len(filtered_data) // stride))
+    src = np.zeros(rows * stride, dtype=np.uint8)
+    src[:min(len(filtered_data), len(src))] = np.frombuffer(filtered_data, dtype=np.uint8)[:len(src)]
+    src = src.reshape(rows, stride)
+    types = src[:, 0]
+    filtered = src[:, 1:]
+
+    pixel_bytes = bytearray(rows * bytes_per_row)
+    if not pixel_bytes:
+        return pixel_bytes
+    out = np.frombuffer(pixel_bytes, dtype=np.uint8).reshape(rows, bytes_per_row)
+
+    # None and Sub only look at the current row, so they are done for all
+    # rows at once. Unknown filter types are treated as None.
+    plain = (types == 0) | (types > 4)
+    out[plain] = filtered[plain]
+    sub = types == 1
+    if sub.any():
+        out[sub] = np.cumsum(filtered[sub].reshape(-1, width, channels), axis=1, dtype=np.uint8).reshape(-1, bytes_per_row)
+
+    if prev_row is None:
+        prev_row = np.zeros(bytes_per_row, dtype=np.uint8)
+    else:
+        prev_row = np.frombuffer(prev_row, dtype=np.uint8)
+    row = 0
+    while row < rows:
+        filter_type = types[row]
+        if filter_type < 2 or filter_type > 4:
+            row += 1
+            continue
+        prev = out[row - 1] if row > 0 else prev_row
+        if filter_type == 2:
+            # A run of Up rows is a cumulative sum down the columns.
+            end = row + 1
+            while end < rows and types[end] == 2:
+                end += 1
+            np.cumsum(filtered[row:end], axis=0, dtype=np.uint8, out=out[row:end])
+            out[row:end] += prev
+            row = end
+            continue
+        start = row * bytes_per_row
+        raw = filtered[row].tobytes()
+        up = prev.tobytes()
+        if filter_type == 3:
+            avg_row(pixel_bytes, start, raw, up, channels)
+        else:
+            paeth_row(pixel_bytes, start, raw, up, channels)
+        row += 1
+
+    return pixel_bytes
+
+
+def palette_decode(decompressed, channels, pixel_count):
+    # 256 colors wrap the one-byte size to 0.
+    palette_size = decompressed[0] or 256
+    palette = np.frombuffer(decompressed[1:1 + palette_size * channels], dtype=np.uint8).reshape(-1, channels)
+    indices_start = 1 + palette_size * channels
+    indices = np.frombuffer(decompressed[indices_start:indices_start + pixel_count], dtype=np.uint8)
+    # Out-of-range indices are skipped, as they always have been.
+    return palette[indices[indices < len(palette)]].tobytes()
+
+
+def tile_boxes(width, height, tile_w, tile_h=None):
+    """Tile rectangles (x, y, w, h) in row-major order; square by default."""
+    tile_h = tile_h or tile_w
+    return [(x, y, min(tile_w, width - x), min(tile_h, height - y))
+            for y in range(0, height, tile_h) for x in range(0, width, tile_w)]
+
+
+TILE_TABLE_HEAD = 8
+TILE_ENTRY = 13
+
+
+def read_tile_table(payload):
+    """Parse a tiled (type 11) payload.
+
+    Layout: tile width and height (2 bytes each), tile count (4 bytes), then
+    per tile its compression type (1 byte), offset (8 bytes) and size
+    (4 bytes), then the tile data. Offsets are relative to the tile data.
+    Returns (tile_w, tile_h, entries, data_start).
+    """
+    tile_w = int.from_bytes(payload[0:2], "little")
+    tile_h = int.from_bytes(payload[2:4], "little")
+    count = int.from_bytes(payload[4:8], "little")
+    entries = []
+    pos = TILE_TABLE_HEAD
+    for _ in range(count):
+        entries.append((payload[pos], int.from_bytes(payload[pos + 1:pos + 9], "little"),
+                        int.from_bytes(payload[pos + 9:pos + 13], "little")))
+        pos += TILE_ENTRY
+    return tile_w, tile_h, entries, pos
+
+
+def read_tile_table_from(f):
+    """read_tile_table for a file positioned at the start of a tiled
+    payload, reading only the table; f is left at the first tile."""
+    head = f.read(TILE_TABLE_HEAD)
+    count = int.from_bytes(head[4:8], "little")
+    return read_tile_table(head + f.read(TILE_ENTRY * count))
+
+
+def tile_table_head(tile_w, tile_h, count):
+    return tile_w.to_bytes(2, "little") + tile_h.to_bytes(2, "little") + count.to_bytes(4, "little")
+
+
+def pack_tile_entry(compression, offset, size):
+    return bytes([compression]) + offset.to_bytes(8, "little") + size.to_bytes(4, "little")
+
+
+def place_tile(out, box, compression, data, channels):
+    x, y, tw, th = box
+    if compression == TILED:
+        raise ValueError("Tiles cannot be tiled themselves")
+    raw = decode_pixels(compression, data, tw, th, channels)
+    tile = np.zeros(tw * th * channels, dtype=np.uint8)
+    n = min(len(raw), len(tile))
+    tile[:n] = np.frombuffer(raw, dtype=np.uint8, count=n)
+    out[y:y + th, x * channels:(x + tw) * channels] = tile.reshape(th, tw * channels)
+
+
+def shared_tile_decode_worker(task):
+    out_name, (width, height, channels), box, compression, data = task
+    dst = shared_memory.SharedMemory(name=out_name)
+    try:
+        out = np.frombuffer(dst.buf, dtype=np.uint8, count=width * height * channels).reshape(height, width * channels)
+        place_tile(out, box, compression, data, channels)
+        del out
+    finally:
+        dst.close()
+
+
+def tiled_decode(payload, width, height, channels):
+    """Decode every tile of a tiled payload, in parallel for large images
+    unless PARALLEL_DECODE is off or this is already a pool worker."""
+    tile_w, tile_h, entries, base = read_tile_table(payload)
+    boxes = tile_boxes(width, height, tile_w, tile_h)
+    if len(boxes) != len(entries):
+        raise ValueError("Tile table does not match the image size")
+    tiles = [(box, t, payload[base + offset:base + offset + size])
+             for box, (t, offset, size) in zip(boxes, entries)]
+    size = width * height * channels
+
+    if (len(tiles) > 1 and width * height > INLINE_MAX_PIXELS
+            and PARALLEL_DECODE and can_start_processes()):
+        pool = get_pool("process")
+        dst = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            pool.map(shared_tile_decode_worker,
+                     [(dst.name, (width, height, channels), box, t, data) for box, t, data in tiles])
+            return bytearray(dst.buf[:size])
+        finally:
+            dst.close()
+            dst.unlink()
+
+    pixel_bytes = bytearray(size)
+    out = np.frombuffer(pixel_bytes, dtype=np.uint8).reshape(height, width * channels)
+    for box, t, data in tiles:
+        place_tile(out, box, t, data, channels)
+    del out
+    return pixel_bytes
+
+
+def split_alpha_payload(alpha_type, alpha, color):
+    """Layout of a split-alpha payload: the alpha plane's compression type
+    (1 byte) and size (4 bytes), the alpha plane, then the color channels
+    coded with the file's own compression type."""
+    return bytes([alpha_type]) + len(alpha).to_bytes(4, "little") + bytes(alpha) + bytes(color)
+
+
+def read_split_alpha(payload):
+    """Return (alpha type, alpha payload, color offset) of a split-alpha payload."""
+    size = int.from_bytes(payload[1:5], "little")
+    return payload[0], payload[5:5 + size], 5 + size
+
+
+def merge_alpha(color, alpha, channels):
+    """Interleave color bytes (channels - 1 per pixel) with an alpha plane."""
+    pixels = min(len(color) // (channels - 1), len(alpha))
+    out = np.empty((pixels, channels), dtype=np.uint8)
+    out[:, :-1] = np.frombuffer(color, dtype=np.uint8, count=pixels * (channels - 1)).reshape(-1, channels - 1)
+    out[:, -1] = np.frombuffer(alpha, dtype=np.uint8, count=pixels)
+    return bytearray(out)
+
+
+def split_alpha_decode(compression, payload, width, height, channels):
+    alpha_type, alpha, start = read_split_alpha(payload)
+    alpha = fit_pixels(decode_pixels(alpha_type, alpha, width, height, 1), width, height, 1)
+    color = fit_pixels(decode_pixels(compression, payload[start:], width, height, channels - 1), width, height, channels - 1)
+    return merge_alpha(color, alpha, channels)
+
+
+def clear_transparent(data, channels):
+    """Zero the color of fully transparent pixels, which no viewer shows.
+    Returns data itself when there is nothing to change."""
+    if channels not in (2, 4):
+        return data
+    px = np.frombuffer(data, dtype=np.uint8).reshape(-1, channels)
+    hidden = px[:, -1] == 0
+    if not px[hidden, :-1].any():
+        return data
+    out = px.copy()
+    out[hidden, :-1] = 0
+    return bytearray(out)
+
+
+def pixels_to_image(raw, width, height, channels):
+    """Wrap decoded bytes as an L, LA, RGB or RGBA image in one bulk copy at most.
+
+    A short buffer is padded with opaque black pixels and a long one is cut,
+    as the loaders always did.
+    """
+    mode = MODES[channels]
+    if not width * height:
+        return Image.new(mode, (width, height))
+    raw = fit_pixels(raw, width, height, channels)
+    return Image.frombuffer(mode, (width, height), raw, "raw", mode, 0, 1)
+
+
+def pixels_to_array(raw, width, height, channels):
+    """View decoded bytes as an (H, W, C) uint8 array without copying them,
+    padded or cut like pixels_to_image. It is writable if raw is."""
+    raw = fit_pixels(raw, width, height, channels)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(height, width, channels)
+
+
+def fit_pixels(raw, width, height, channels):
+    """Return raw itself if it holds exactly the image, otherwise a copy
+    padded with opaque black pixels or cut to size."""
+    size = width * height * channels
+    if len(raw) == size:
+        return raw
+    buf = bytearray(size)
+    n = min(len(raw), size)
+    buf[:n] = raw[:n]
+    if channels in (2, 4):
+        first_missing = -(-n // channels)
+        buf[first_missing * channels + channels - 1::channels] = b"\xff" * (width * height - first_missing)
+    return buf
+
+
+def convert_pixels(raw, channels, out_channels):
+    """Convert pixel bytes between L, LA, RGB and RGBA with array copies.
+
+    Gray is repeated into R, G and B, a missing alpha is opaque, and color
+    becomes gray with the ITU-R 601 weights Pillow's convert("L") uses.
+    Returns raw itself when nothing changes.
+    """
+    if out_channels == channels:
+        return raw
+    px = np.frombuffer(raw, dtype=np.uint8, count=len(raw) // channels * channels).reshape(-1, channels)
+    out = np.empty((len(px), out_channels), dtype=np.uint8)
+    if out_channels <= 2 and channels >= 3:
+        # Pillow's fixed point: 299/587/114 per mille in 16-bit fractions, rounded.
+        luma = px[:, :3].astype(np.uint32) @ np.array([19595, 38470, 7471], dtype=np.uint32)
+        out[:, 0] = (luma + 0x8000) >> 16
+    else:
+        colors = 1 if out_channels <= 2 else 3
+        out[:, :colors] = px[:, :1] if channels <= 2 else px[:, :colors]
+    if out_channels in (2, 4):
+        out[:, -1] = px[:, -1] if channels in (2, 4) else 255
+    return bytearray(out)
+
+
+# Encoders, one per compression method save_pix can search. Each takes
+# (data, width, height, channels, level, filters, effort, stages) and returns
+# (size, type, payload, name), with an infinite size when the method does not
+# apply to the image. If stages is a dict, the output size of each
+# intermediate stage (rle, filter, palette, zlib, zlib_outer) is recorded in it.
+def filtered_size(width, height, channels):
+    # Filtering always works on height rows, each with its filter byte.
+    return height * (width * channels + 1)
+
+
+def encode_raw(data, width, height, channels, level, filters, effort, stages):
+    return (len(data), RAW, data, "raw")
+
+
+def encode_rle(data, width, height, channels, level, filters, effort, stages):
+    runs = rle_encode(data, channels)
+    comp = zlib.compress(runs, level=level)
+    stages.update(rle=len(runs), zlib=len(comp))
+    return (len(comp), RLE, comp, "rle")
+
+
+def encode_rle_varint(data, width, height, channels, level, filters, effort, stages):
+    runs = rle_varint_encode(data, channels)
+    comp = zlib.compress(runs, level=level)
+    stages.update(rle=len(runs), zlib=len(comp))
+    return (len(comp), RLE_VARINT, comp, "rle_varint")
+
+
+def encode_zlib(data, width, height, channels, level, filters, effort, stages):
+    comp = zlib.compress(data, level=level)
+    stages.update(zlib=len(comp))
+    return (len(comp), ZLIB, comp, "zlib")
+
+
+def zlib_strategy_encoder(name):
+    """Encoder for one of ZLIB_STRATEGIES, stored as type ZLIB_STRATEGY."""
+    strategy = ZLIB_STRATEGIES[name]
+
+    def encode(data, width, height, channels, level, filters, effort, stages):
+        compressor = zlib.compressobj(level=level, strategy=strategy)
+        comp = compressor.compress(data) + compressor.flush()
+        stages.update(zlib=len(comp))
+        return (len(comp), ZLIB_STRATEGY, comp, name)
+    return encode
+
+
+def encode_png_row(data, width, height, channels, level, filters, effort, stages):
+    comp = png_filter(data, width, height, channels, level, filters)
+    stages.update(filter=filtered_size(width, height, channels), zlib=len(comp))
+    return (len(comp), PNG_ROW, comp, "png_row")
+
+
+def encode_png_all(data, width, height, channels, level, filters, effort, stages):
+    result = png_filter_all(data, width, height, channels, level, filters)
+    stages.update(filter=filtered_size(width, height, channels), zlib=result[0])
+    return result
+
+
+def encode_rle_png_row(data, width, height, channels, level, filters, effort, stages):
+    runs = rle_encode(data, channels)
+    comp = png_filter(runs, width, height, channels, level, filters)
+    stages.update(rle=len(runs), filter=filtered_size(width, height, channels), zlib=len(comp))
+    return (len(comp), RLE_PNG_ROW, comp, "rle+png_row")
+
+
+def encode_rle_png_all(data, width, height, channels, level, filters, effort, stages):
+    runs = rle_encode(data, channels)
+    result = png_filter_all(runs, width, height, channels, level, filters)
+    stages.update(rle=len(runs), filter=filtered_size(width, height, channels), zlib=result[0])
+    return result
+
+
+def encode_png_row_zlib(data, width, height, channels, level, filters, effort, stages):
+    comp = png_filter(data, width, height, channels, level, filters)
+    comp2 = zlib.compress(comp, level=level)
+    stages.update(filter=filtered_size(width, height, channels), zlib=len(comp), zlib_outer=len(comp2))
+    return (len(comp2), PNG_ROW_ZLIB, comp2, "png_row+zlib")
+
+
+def encode_png_all_zlib(data, width, height, channels, level, filters, effort, stages):
+    _, _, comp, _ = png_filter_all(data, width, height, channels, level, filters)
+    comp2 = zlib.compress(comp, level=level)
+    stages.update(filter=filtered_size(width, height, channels), zlib=len(comp), zlib_outer=len(comp2))
+    return (len(comp2), PNG_ALL_ZLIB, comp2, "png_all+zlib")
+
+
+def encode_palette(data, width, height, channels, level, filters, effort, stages):
+    comp, unique = palette_encode(data, width, height, channels, level)
+    if comp is None:
+        # The palette size is stored in one byte.
+        return (float('inf'), -1, None, f"palette_{unique}")
+    stages.update(palette=1 + unique * channels + width * height, zlib=len(comp))
+    return (len(comp), PALETTE, comp, f"palette_{unique}")
+
+
+# Both palette orders are only worth trying from this effort up.
+PALETTE_ORDERS_EFFORT = 8
+
+
+def encode_palette_packed(data, width, height, channels, level, filters, effort, stages):
+    orders = PALETTE_ORDERS if effort >= PALETTE_ORDERS_EFFORT else PALETTE_ORDERS[:1]
+    comp, unique = palette_packed_encode(data, width, height, channels, level, orders)
+    if comp is None:
+        return (float('inf'), -1, None, f"palette_packed_{unique}")
+    stages.update(palette=3 + unique * channels + height * packed_row_bytes(width, index_bits(unique)), zlib=len(comp))
+    return (len(comp), PALETTE_PACKED, comp, f"palette_packed_{unique}")
+
+
+# method name -> encoder, in the order to_pix lists them. Tiled payloads are
+# assembled by to_pix.tiled_compress, which runs its own method search.
+ENCODERS = {}
+
+
+def register_encoder(name, encode):
+    ENCODERS[name] = encode
+
+
+def encode_method(method, data, width, height, channels, level, filters, effort, stages=None):
+    """Encode with one method and return (size, type, payload, name)."""
+    encode = ENCODERS.get(method)
+    if encode is None:
+        raise ValueError(f"Unknown compression method: {method}")
+    return encode(data, width, height, channels, level, filters, effort, {} if stages is None else stages)
+
+
+register_encoder("raw", encode_raw)
+register_encoder("rle", encode_rle)
+register_encoder("rle_varint", encode_rle_varint)
+register_encoder("zlib", encode_zlib)
+for method in ZLIB_STRATEGIES:
+    register_encoder(method, zlib_strategy_encoder(method))
+register_encoder("png_row", encode_png_row)
+register_encoder("png_all", encode_png_all)
+register_encoder("rle+png_row", encode_rle_png_row)
+register_encoder("rle+png_all", encode_rle_png_all)
+register_encoder("png_row+zlib", encode_png_row_zlib)
+register_encoder("png_all+zlib", encode_png_all_zlib)
+register_encoder("palette", encode_palette)
+register_encoder("palette_packed", encode_palette_packed)
+
+
+# type ID -> (name, decode). decode(payload, width, height, channels) returns
+# pixel bytes with the given number of channels.
+CODECS = {}
+
+
+def register(type_id, name, decode):
+    CODECS[type_id] = (name, decode)
+
+
+def decode_pixels(compression, compressed_data, width, height, channels):
+    """Decode a compressed stream to raw pixel bytes with channels per pixel."""
+    if compression & SPLIT_ALPHA:
+        return split_alpha_decode(compression & ~SPLIT_ALPHA, compressed_data, width, height, channels)
+    codec = CODECS.get(compression)
+    if codec is None:
+        raise ValueError(f"Unsupported compression type: {compression}")
+    return codec[1](compressed_data, width, height, channels)
+
+
+register(RAW, "raw", lambda d, w, h, c: d)
+register(RLE, "rle", lambda d, w, h, c: run_length_decode(zlib.decompress(d), c, w * h))
+register(ZLIB, "zlib", lambda d, w, h, c: zlib.decompress(d))
+register(ZLIB_STRATEGY, "zlib_strategy", lambda d, w, h, c: zlib.decompress(d))
+register(DELTA, "delta", lambda d, w, h, c: predictive_decode(zlib.decompress(d), c, w, h, "simple_delta"))
+register(PALETTE, "palette", lambda d, w, h, c: palette_decode(zlib.decompress(d), c, w * h))
+register(PNG_ROW, "png_row", png_filter_decode)
+register(PNG_ALL, "png_all", png_filter_decode)
+register(RLE_PNG_ROW, "rle+png_row", lambda d, w, h, c: run_length_decode(png_filter_decode(d, w, h, c), c, w * h))
+register(PNG_ROW_ZLIB, "png_row+zlib", lambda d, w, h, c: png_filter_decode(zlib.decompress(d), w, h, c))
+register(PNG_ALL_ZLIB, "png_all+zlib", lambda d, w, h, c: png_filter_decode(zlib.decompress(d), w, h, c))
+register(TILED, "tiled", tiled_decode)
+register(RLE_VARINT, "rle_varint", lambda d, w, h, c: rle_varint_decode(zlib.decompress(d), c, w * h))
+register(PALETTE_PACKED, "palette_packed", lambda d, w, h, c: palette_packed_decode(zlib.decompress(d), w, h, c))
+
+
+# Streaming decode: bands of rows with memory bounded by the band size.
+READ_CHUNK = 1 << 16
+BAND_ROWS = 16
+
+
+def read_chunks(f):
+    while True:
+        chunk = f.read(READ_CHUNK)
+        if not chunk:
+            return
+        yield chunk
+
+
+def inflate_chunks(chunks):
+    """Decompress a stream of chunks, never producing more than READ_CHUNK at once."""
+    d = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk and not d.eof:
+            out = d.decompress(chunk, READ_CHUNK)
+            if out:
+                yield out
+            chunk = d.unconsumed_tail
+        if d.eof:
+            return
+    out = d.flush()
+    if out:
+        yield out
+
+
+def records(chunks, size):
+    """Regroup chunks into size-byte records; the last one may be shorter."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        if len(buf) >= size:
+            n = len(buf) - len(buf) % size
+            for i in range(0, n, size):
+                yield bytes(buf[i:i + size])
+            del buf[:n]
+    if buf:
+        yield bytes(buf)
+
+
+def stream_rle(chunks, channels):
+    for block in records(chunks, (1 + channels) * 4096):
+        yield run_length_decode(block, channels, len(block) // (1 + channels) * 255 + 1)
+
+
+def stream_rle_varint(chunks, channels, piece_pixels):
+    """Expand varint RLE one block at a time, in pieces of at most
+    piece_pixels pixels however long the runs are."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= RLE_BLOCK_HEAD and len(buf) >= rle_block_size(buf, 0, channels):
+            pixels, counts, size = read_rle_block(bytes(buf[:rle_block_size(buf, 0, channels)]), 0, channels)
+            for piece in expand_runs(pixels, counts, piece_pixels):
+                yield piece.tobytes()
+            del buf[:size]
+    while len(buf) >= RLE_BLOCK_HEAD:
+        # A truncated last block.
+        pixels, counts, size = read_rle_block(bytes(buf), 0, channels)
+        for piece in expand_runs(pixels, counts, piece_pixels):
+            yield piece.tobytes()
+        del buf[:size]
+
+
+def stream_delta(chunks, channels):
+    prev = np.zeros(channels, dtype=np.uint8)
+    for block in records(chunks, channels * 16384):
+        deltas = np.frombuffer(block, dtype=np.uint8)
+        usable = len(deltas) - len(deltas) % channels
+        pixels = np.cumsum(deltas[:usable].reshape(-1, channels), axis=0, dtype=np.uint8)
+        pixels += prev
+        if len(pixels):
+            prev = pixels[-1].copy()
+        yield pixels.tobytes()
+
+
+def prepend(first, chunks):
+    if first:
+        yield bytes(first)
+    yield from chunks
+
+
+def stream_palette(chunks, channels, pixel_count):
+    chunks = iter(chunks)
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if head and len(head) >= 1 + (head[0] or 256) * channels:
+            break
+    if not head:
+        return
+    palette_size = head[0] or 256
+    palette = np.frombuffer(bytes(head[1:1 + palette_size * channels]), dtype=np.uint8).reshape(-1, channels)
+    rest = head[1 + palette_size * channels:]
+    remaining = pixel_count
+    for block in records(prepend(rest, chunks), READ_CHUNK):
+        indices = np.frombuffer(block[:remaining], dtype=np.uint8)
+        remaining -= len(indices)
+        yield palette[indices[indices < len(palette)]].tobytes()
+        if remaining <= 0:
+            return
+
+
+def stream_palette_packed(chunks, width, channels, band_rows):
+    chunks = iter(chunks)
+    head = bytearray()
+    palette_end = lambda: 3 + (int.from_bytes(head[1:3], "little") + 1) * channels
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 3 and len(head) >= palette_end():
+            break
+    if len(head) < 3 or len(head) < palette_end():
+        return
+    bits, palette, start = palette_packed_header(bytes(head), channels)
+    for block in records(prepend(head[start:], chunks), packed_row_bytes(width, bits) * band_rows):
+        indices = unpack_indices(block, width, bits)
+        yield palette[np.where(indices < len(palette), indices, 0)].tobytes()
+
+
+def stream_png(chunks, width, channels, band_rows):
+    stride = width * channels + 1
+    prev = None
+    for block in records(chunks, stride * band_rows):
+        rows = png_unfilter(block, width, -(-len(block) // stride), channels, prev)
+        if rows:
+            prev = bytes(rows[-width * channels:]) if width * channels else None
+        yield rows
+
+
+def stream_tiled(f, width, height, channels):
+    data_start = f.tell()
+    tile_w, tile_h, entries, base = read_tile_table_from(f)
+    boxes = tile_boxes(width, height, tile_w, tile_h)
+    if len(boxes) != len(entries):
+        raise ValueError("Tile table does not match the image size")
+    per_row = -(-width // tile_w) if width else 0
+    for i in range(0, len(boxes), per_row or 1):
+        band_h = boxes[i][3]
+        band = np.zeros((band_h, width * channels), dtype=np.uint8)
+        for (x, _, tw, th), (t, offset, size) in zip(boxes[i:i + per_row], entries[i:i + per_row]):
+            f.seek(data_start + base + offset)
+            place_tile(band, (x, 0, tw, th), t, f.read(size), channels)
+        yield band.tobytes()
+
+
+def stream_split_alpha(f, header, band_rows):
+    """Bands of a split-alpha file: the alpha plane is read whole but still
+    compressed, and decoded in bands next to the color channels."""
+    head = f.read(5)
+    alpha = f.read(int.from_bytes(head[1:5], "little"))
+    plane = dict(header, compression=head[0] if head else RAW, gray=True, has_alpha=False)
+    color = dict(header, compression=header["compression"] & ~SPLIT_ALPHA, has_alpha=False)
+    channels = header_channels(header)
+    for color_band, alpha_band in zip(iter_pix_rows(f, color, band_rows), iter_pix_rows(io.BytesIO(alpha), plane, band_rows)):
+        yield bytes(merge_alpha(color_band, alpha_band, channels))
+
+
+def iter_pix_rows(f, header, band_rows=BAND_ROWS):
+    """Decode the pixel data after read_header(f) as bands of whole rows.
+
+    Each band is the raw bytes of up to band_rows rows, with the channels
+    stored in the file (see header_channels). Memory
+    stays proportional to a band (a row of tiles for tiled files) no matter
+    how large the image is. Missing data at the end of a truncated file comes
+    out as zero rows.
+    """
+    width = header["width"]
+    height = header["height"]
+    compression = header["compression"]
+    channels = header_channels(header)
+    pixel_count = width * height
+
+    if compression & SPLIT_ALPHA:
+        yield from stream_split_alpha(f, header, band_rows)
+        return
+    if compression == RAW:
+        pixels = read_chunks(f)
+    elif compression == RLE:
+        pixels = stream_rle(inflate_chunks(read_chunks(f)), channels)
+    elif compression in (ZLIB, ZLIB_STRATEGY):
+        pixels = inflate_chunks(read_chunks(f))
+    elif compression == DELTA:
+        pixels = stream_delta(inflate_chunks(read_chunks(f)), channels)
+    elif compression == PALETTE:
+        pixels = stream_palette(inflate_chunks(read_chunks(f)), channels, pixel_count)
+    elif compression in (PNG_ROW, PNG_ALL):
+        pixels = stream_png(inflate_chunks(read_chunks(f)), width, channels, band_rows)
+    elif compression == RLE_PNG_ROW:
+        rle_data = stream_png(inflate_chunks(read_chunks(f)), width, channels, band_rows)
+        pixels = stream_rle(rle_data, channels)
+    elif compression in (PNG_ROW_ZLIB, PNG_ALL_ZLIB):
+        pixels = stream_png(inflate_chunks(inflate_chunks(read_chunks(f))), width, channels, band_rows)
+    elif compression == TILED:
+        pixels = stream_tiled(f, width, height, channels)
+    elif compression == RLE_VARINT:
+        pixels = stream_rle_varint(inflate_chunks(read_chunks(f)), channels, max(1, band_rows * width))
+    elif compression == PALETTE_PACKED:
+        pixels = stream_palette_packed(inflate_chunks(read_chunks(f)), width, channels, band_rows)
+    else:
+        raise ValueError(f"Unsupported compression type: {compression}")
+
+    band_bytes = max(1, band_rows * width * channels)
+    remaining = pixel_count * channels
+    for band in records(pixels, band_bytes):
+        band = bytes(band[:remaining]).ljust(min(band_bytes, remaining), b"\0")
+        remaining -= len(band)
+        yield band
+        if remaining <= 0:
+            return
+    while remaining > 0:
+        n = min(band_bytes, remaining)
+        remaining -= n
+        yield bytes(n)
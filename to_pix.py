@@ -1,277 +1,926 @@
 # to_pix.py
 
 from PIL import Image
+import numpy as np
 import sys
+import os
 import zlib
-import multiprocessing
-
-
-def has_alpha(pixels):
-    for r, g, b, a in pixels:
-        if a != 255:
-            return True
-    return False
-
-
-def rle_encode(data, channels):
-    if not data:
-        return bytearray()
-    result = bytearray()
-    i = 0
-    while i < len(data):
-        pixel = data[i:i+channels]
-        run = 1
-        while (i + run * channels < len(data) and 
-               run < 255 and
-               data[i + run * channels:i + (run + 1) * channels] == pixel):
-            run += 1
-        result.append(run)
-        result.extend(pixel)
-        i += run * channels
-    return result
+import tempfile
+import hashlib
+import json
+import time
+import contextlib
+from multiprocessing import shared_memory
+from pix_codec import (
+    ALL_FILTERS, ZLIB_STRATEGIES, INLINE_MAX_PIXELS, get_pool, write_header,
+    can_start_processes, rle_encode, as_rows, filter_rows, pick_row_filters,
+    png_filter, tile_boxes, read_tile_table, tile_table_head, pack_tile_entry,
+    TILE_TABLE_HEAD, TILE_ENTRY, read_header, png_unfilter, rle_varint_encode,
+    palette_packed_encode, PALETTE_ORDERS, PALETTE_PACKED_MAX, pack_pixels,
+    MODES, header_channels, convert_pixels, clear_transparent,
+    split_alpha_payload, inflate_chunks, records, iter_pix_rows, ENCODERS,
+    encode_method, RAW, RLE, ZLIB, ZLIB_STRATEGY, PNG_ROW, PNG_ALL,
+    PNG_ROW_ZLIB, PNG_ALL_ZLIB, TILED, RLE_VARINT, PALETTE_PACKED, SPLIT_ALPHA,
+)
+
+# effort: (methods save_pix tries, zlib level, PNG filters searched, top_k)
+# The palette methods are only tried when the image has few enough colors
+# (see PALETTE_LIMITS); top_k=None means every method is fully encoded.
+EFFORT_LEVELS = {
+    0: (["raw", "zlib"], 1, (0,), None),
+    1: (["raw", "zlib", "png_row"], 1, (2,), None),
+    2: (["raw", "zlib", "png_row"], 3, (2,), None),
+    3: (["raw", "zlib", "png_row", "png_all"], 6, (1, 2), None),
+    4: (["raw", "zlib", "zlib_filtered", "png_row", "png_all"], 6, (1, 2, 4), None),
+    5: (["raw", "zlib", "zlib_filtered", "png_row", "png_all"], 6, ALL_FILTERS, None),
+    6: (["raw", "rle", "rle_varint", "zlib", "zlib_filtered", "png_row", "png_all", "palette", "palette_packed"], 6, ALL_FILTERS, 2),
+    7: (["raw", "rle", "rle_varint", "zlib", "zlib_default", "zlib_filtered", "zlib_huffman", "png_row", "png_all", "palette", "palette_packed"], 9, ALL_FILTERS, 2),
+    8: (["raw", "rle", "rle_varint", "zlib", "zlib_default", "zlib_filtered", "zlib_huffman", "png_row", "png_all", "palette", "palette_packed"], 9, ALL_FILTERS, 4),
+    9: (["raw", "rle", "rle_varint", "zlib", "zlib_default", "zlib_filtered", "zlib_huffman", "png_row", "png_all", "palette", "palette_packed"], 9, ALL_FILTERS, None),
+}
+MAX_EFFORT = 9
+
+# Non-binary alpha is only tried as a separate plane from this effort up.
+SPLIT_ALPHA_EFFORT = 6
+
+# Most colors each palette method can store.
+PALETTE_LIMITS = {"palette": 255, "palette_packed": PALETTE_PACKED_MAX}
+
+TILE_SIZE = 256
+
+# Encode cache: finished payloads keyed by pixel hash and settings.
+CACHE_DIR = os.environ.get("PIX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pix"))
+CACHE_MAX_BYTES = 256 << 20
+# Bump when the entry layout or any encoder's output changes, so old entries
+# are neither found nor trusted.
+CACHE_VERSION = 2
+CACHE_DIGEST_SIZE = 16
+
+
+def has_alpha(img):
+    return img.mode == "RGBA" and img.getextrema()[3][0] != 255
+
+
+def is_gray(arr):
+    """True if R = G = B for every pixel of an (H, W, 3 or 4) array."""
+    return bool((arr[:, :, 0] == arr[:, :, 1]).all() and (arr[:, :, 0] == arr[:, :, 2]).all())
+
+
+def read_image(input_file):
+    """Open an image as L, LA, RGB or RGBA; see normalize_image."""
+    return normalize_image(Image.open(input_file))
+
+
+def normalize_image(img):
+    """Convert an image to RGB, or RGBA if any pixel is not fully opaque,
+    then to L or LA if every pixel is gray. Returns (image, has alpha)."""
+    source_mode = img.mode
+    bands = img.getbands()
+    if "A" in bands or "a" in bands or "transparency" in img.info:
+        img = img.convert("RGBA")
+        if not has_alpha(img):
+            img = img.convert("RGB")
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    use_alpha = img.mode == "RGBA"
+    if source_mode in ("L", "LA") or is_gray(np.asarray(img)):
+        # Taken from a band rather than converted, so no value is rounded.
+        gray = img.getchannel("R")
+        img = Image.merge("LA", (gray, img.getchannel("A"))) if use_alpha else gray
+    return img, use_alpha
+
+
+def compress_worker(task, stages=None):
+    """Compress with one method and return (size, type, payload, name).
+
+    If stages is a dict, the output size of each intermediate stage (rle,
+    filter, palette, zlib, zlib_outer) is recorded in it.
+    """
+    method, data, args = task
+    w, h, c = args[:3]
+    effort = args[3] if len(args) > 3 else MAX_EFFORT
+    _, level, filters, _ = EFFORT_LEVELS[effort]
+    if method not in ENCODERS:
+        return (float('inf'), -1, None, "error")
+    return encode_method(method, data, w, h, c, level, filters, effort, stages)
+
 
+def measured_worker(task):
+    """compress_worker plus its wall time, CPU time and stage sizes."""
+    stages = {}
+    wall, cpu = time.perf_counter(), time.thread_time()
+    result = compress_worker(task, stages)
+    info = {"wall_s": time.perf_counter() - wall, "cpu_s": time.thread_time() - cpu, "stages": stages}
+    return result, info
 
-def png_filter(data, width, height, channels):
-    filtered = bytearray()
-    row_bytes = width * channels
-    for row in range(height):
-        start = row * row_bytes
-        row_data = data[start:start + row_bytes]
-        attempts = []
-        none_f = bytearray([0]) + row_data
-        attempts.append(none_f)
-        if width > 1:
-            sub_f = bytearray([1])
-            for i in range(len(row_data)):
-                if i < channels:
-                    sub_f.append(row_data[i])
-                else:
-                    sub_f.append((row_data[i] - row_data[i - channels]) % 256)
-            attempts.append(sub_f)
-        if row > 0:
-            up_f = bytearray([2])
-            prev_row = data[(row - 1) * row_bytes:row * row_bytes]
-            for i in range(len(row_data)):
-                up_f.append((row_data[i] - prev_row[i]) % 256)
-            attempts.append(up_f)
-        if row > 0 and width > 1:
-            avg_f = bytearray([3])
-            prev_row = data[(row - 1) * row_bytes:row * row_bytes]
-            for i in range(len(row_data)):
-                left = row_data[i - channels] if i >= channels else 0
-                up = prev_row[i]
-                pred = (left + up) // 2
-                avg_f.append((row_data[i] - pred) % 256)
-            attempts.append(avg_f)
-        if row > 0:
-            paeth_f = bytearray([4])
-            prev_row = data[(row - 1) * row_bytes:row * row_bytes]
-            for i in range(len(row_data)):
-                left = row_data[i - channels] if i >= channels else 0
-                up = prev_row[i]
-                up_left = prev_row[i - channels] if i >= channels else 0
-                p = left + up - up_left
-                pa = abs(p - left)
-                pb = abs(p - up)
-                pc = abs(p - up_left)
-                if pa <= pb and pa <= pc:
-                    pred = left
-                elif pb <= pc:
-                    pred = up
-                else:
-                    pred = up_left
-                paeth_f.append((row_data[i] - pred) % 256)
-            attempts.append(paeth_f)
-        best = min(attempts, key=lambda x: sum(abs(b - 128) for b in x[1:]))
-        filtered.extend(best)
-    return zlib.compress(filtered, level=9)
-
-
-def png_filter_all(data, width, height, channels):
-    row_bytes = width * channels
-    none_d, sub_d, up_d, avg_d, paeth_d = bytearray(), bytearray(), bytearray(), bytearray(), bytearray()
-    for row in range(height):
-        start = row * row_bytes
-        row_data = data[start:start + row_bytes]
-        none_d.extend([0])
-        none_d.extend(row_data)
-        sub_d.extend([1])
-        for i in range(len(row_data)):
-            if i < channels:
-                sub_d.append(row_data[i])
+
+def shared_compress_worker(task):
+    """compress_worker over a pixel buffer published in shared memory.
+
+    The payload is written into the task's own output block instead of being
+    pickled back. A payload that does not fit the block is not written, and
+    only its size is reported. Returns the result and its measured_worker info.
+    """
+    method, in_name, out_name, size, capacity, args = task
+    src = shared_memory.SharedMemory(name=in_name)
+    try:
+        data = src.buf[:size]
+        (comp_size, t, comp, name), info = measured_worker((method, data, args))
+        if comp is not None and comp is not data and comp_size <= capacity:
+            dst = shared_memory.SharedMemory(name=out_name)
+            dst.buf[:comp_size] = comp
+            dst.close()
+        comp = None
+        data.release()
+    finally:
+        src.close()
+    return (comp_size, t, None, name), info
+
+
+def run_shared(pool, tasks):
+    """Run compress_worker tasks that share one pixel buffer in a process pool.
+
+    The buffer is copied into shared memory once and workers attach to it by
+    name. Results and their measured_worker infos come back in task order;
+    only the smallest result carries its payload, and it is dropped (infinite
+    size) if it did not fit its output block, since no worker stored it.
+    """
+    data = tasks[0][1]
+    size = len(data)
+    # Room for payloads slightly larger than the input, which still win when
+    # raw is not among the candidates (the color half of a split-alpha encode).
+    capacity = size + size // 8 + 1024
+    blocks = []
+    try:
+        src = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        blocks.append(src)
+        src.buf[:size] = data
+        shared_tasks = []
+        for method, _, args in tasks:
+            out = shared_memory.SharedMemory(create=True, size=capacity)
+            blocks.append(out)
+            shared_tasks.append((method, src.name, out.name, size, capacity, args))
+        results, infos = map(list, zip(*pool.map(shared_compress_worker, shared_tasks)))
+        best = min(range(len(results)), key=lambda i: results[i][0])
+        chosen_size, t, _, name = results[best]
+        if chosen_size > capacity:
+            results[best] = (float('inf'), -1, None, name)
+        elif chosen_size != float('inf'):
+            if t == RAW:
+                chosen = data
             else:
-                sub_d.append((row_data[i] - row_data[i - channels]) % 256)
-        up_d.extend([2])
-        if row == 0:
-            up_d.extend(row_data)
+                chosen = bytes(blocks[best + 1].buf[:chosen_size])
+            results[best] = (chosen_size, t, chosen, name)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return results, infos
+
+
+# Methods that spend nearly all their time inside zlib, which releases the GIL.
+THREAD_METHODS = {"raw", "zlib", "zlib_default", "zlib_filtered", "zlib_huffman"}
+
+EXECUTORS = ["auto", "inline", "thread", "process"]
+
+
+def pick_executor(method, pixel_count, executor="auto"):
+    if executor == "auto":
+        if pixel_count <= INLINE_MAX_PIXELS:
+            return "inline"
+        executor = "thread" if method in THREAD_METHODS else "process"
+    if executor == "process" and not can_start_processes():
+        # A pool worker cannot start a pool of its own.
+        return "thread"
+    return executor
+
+
+def run_tasks(tasks, executor="auto", stats=None):
+    """Run compress_worker tasks inline, on threads or on processes.
+
+    With executor="auto" the choice is made per task from the image size and
+    the method. Results come back in task order. Tasks run in the process
+    pool only carry the payload of their group's smallest result. If stats is
+    a list, one measured_worker info per task is appended to it, in order.
+    """
+    groups = {"inline": [], "thread": [], "process": []}
+    for i, (method, _, args) in enumerate(tasks):
+        groups[pick_executor(method, args[0] * args[1], executor)].append(i)
+
+    results = [None] * len(tasks)
+    infos = [None] * len(tasks)
+    process_pool = get_pool("process") if groups["process"] else None
+    pending = []
+    if groups["thread"]:
+        thread_pool = get_pool("thread")
+        pending = [(i, thread_pool.submit(measured_worker, tasks[i])) for i in groups["thread"]]
+    if groups["process"]:
+        shared, shared_infos = run_shared(process_pool, [tasks[i] for i in groups["process"]])
+        for i, result, info in zip(groups["process"], shared, shared_infos):
+            results[i], infos[i] = result, info
+    for i in groups["inline"]:
+        results[i], infos[i] = measured_worker(tasks[i])
+    for i, future in pending:
+        results[i], infos[i] = future.result()
+    if stats is not None:
+        for mode, indices in groups.items():
+            for i in indices:
+                infos[i].update(method=tasks[i][0], executor=mode)
+        stats.extend(infos)
+    return results
+
+
+def color_count(img):
+    """Number of colors in img, or None if there are more than any palette
+    method can store."""
+    colors = img.getcolors(max(PALETTE_LIMITS.values()))
+    return len(colors) if colors is not None else None
+
+
+def palette_methods(methods, colors):
+    """Drop the palette methods whose limit is below the color count."""
+    return [m for m in methods if m not in PALETTE_LIMITS or (colors is not None and colors <= PALETTE_LIMITS[m])]
+
+
+def compress_tile(data, w, h, c, box, methods, effort):
+    """Try every method on one tile and return (type, payload) of the smallest."""
+    x, y, tw, th = box
+    tile = as_rows(data, w, h, c)[y:y + th, x * c:(x + tw) * c].tobytes()
+    if any(m in PALETTE_LIMITS for m in methods):
+        img = Image.frombytes(MODES[c], (tw, th), tile)
+        methods = palette_methods(methods, color_count(img))
+    results = [compress_worker((m, tile, (tw, th, c, effort))) for m in methods]
+    size, t, comp, _ = min(results, key=lambda x: x[0])
+    return t, comp
+
+
+def shared_tile_worker(task):
+    in_name, size, (w, h, c), box, methods, effort = task
+    src = shared_memory.SharedMemory(name=in_name)
+    try:
+        data = src.buf[:size]
+        result = compress_tile(data, w, h, c, box, methods, effort)
+        data.release()
+    finally:
+        src.close()
+    return result
+
+
+def tiled_compress(data, w, h, c, methods, effort, tile_size=TILE_SIZE, executor="auto"):
+    """Encode the image as independent tiles, each with its own best method.
+
+    See pix_codec.read_tile_table for the layout. Tiles are spread over the
+    process pool through one shared copy of the pixels.
+    """
+    methods = ["raw"] + [m for m in methods if m != "raw"]
+    boxes = tile_boxes(w, h, tile_size)
+    mode = pick_executor("tiled", w * h, executor)
+    if mode == "process" and len(boxes) > 1:
+        size = len(data)
+        src = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            src.buf[:size] = data
+            pool = get_pool("process")
+            tiles = pool.map(shared_tile_worker, [(src.name, size, (w, h, c), box, methods, effort) for box in boxes])
+        finally:
+            src.close()
+            src.unlink()
+    elif mode == "thread":
+        tiles = list(get_pool("thread").map(lambda box: compress_tile(data, w, h, c, box, methods, effort), boxes))
+    else:
+        tiles = [compress_tile(data, w, h, c, box, methods, effort) for box in boxes]
+
+    table = bytearray(tile_table_head(tile_size, tile_size, len(tiles)))
+    offset = 0
+    for t, comp in tiles:
+        table += pack_tile_entry(t, offset, len(comp))
+        offset += len(comp)
+    payload = bytes(table) + b"".join(comp for _, comp in tiles)
+    return (len(payload), TILED, payload, f"tiled_{tile_size}")
+
+
+def splice_tiles(payload, data, w, h, c, dirty, effort):
+    """Rebuild a tiled payload, re-encoding only the tiles listed in dirty.
+
+    Every other tile keeps its compressed bytes from payload. data holds the
+    new pixels for the whole image.
+    """
+    tile_size, _, entries, data_start = read_tile_table(payload)
+    methods = ["raw"] + [m for m in EFFORT_LEVELS[effort][0] if m != "raw"]
+    boxes = tile_boxes(w, h, tile_size)
+    table = bytearray(payload[:TILE_TABLE_HEAD])
+    chunks = []
+    offset = 0
+    for i, (box, (t, start, size)) in enumerate(zip(boxes, entries)):
+        if i in dirty:
+            t, comp = compress_tile(data, w, h, c, box, methods, effort)
         else:
-            prev_row = data[(row - 1) * row_bytes:row * row_bytes]
-            for i in range(len(row_data)):
-                up_d.append((row_data[i] - prev_row[i]) % 256)
-        avg_d.extend([3])
-        prev_row = data[(row - 1) * row_bytes:row * row_bytes] if row > 0 else bytearray(row_bytes)
-        for i in range(len(row_data)):
-            left = row_data[i - channels] if i >= channels else 0
-            up = prev_row[i]
-            pred = (left + up) // 2
-            avg_d.append((row_data[i] - pred) % 256)
-        paeth_d.extend([4])
-        prev_row = data[(row - 1) * row_bytes:row * row_bytes] if row > 0 else bytearray(row_bytes)
-        for i in range(len(row_data)):
-            left = row_data[i - channels] if i >= channels else 0
-            up = prev_row[i]
-            up_left = prev_row[i - channels] if i >= channels else 0
-            p = left + up - up_left
-            pa = abs(p - left)
-            pb = abs(p - up)
-            pc = abs(p - up_left)
-            if pa <= pb and pa <= pc:
-                pred = left
-            elif pb <= pc:
-                pred = up
-            else:
-                pred = up_left
-            paeth_d.append((row_data[i] - pred) % 256)
-    filters = {
-        "PNG_none": zlib.compress(none_d, level=9),
-        "PNG_sub": zlib.compress(sub_d, level=9),
-        "PNG_up": zlib.compress(up_d, level=9),
-        "PNG_avg": zlib.compress(avg_d, level=9),
-        "PNG_paeth": zlib.compress(paeth_d, level=9),
-    }
-    best = min(filters, key=lambda x: len(filters[x]))
-    return (len(filters[best]), 7, filters[best], best)
-
-
-def compress_worker(task):
-    method, data, args = task
-    w, h, c = args
+            comp = payload[data_start + start:data_start + start + size]
+        table += pack_tile_entry(t, offset, len(comp))
+        chunks.append(comp)
+        offset += len(comp)
+    return bytes(table) + b"".join(chunks)
 
-    if method == "raw":
-        return (len(data), 0, data, "raw")
-
-    elif method == "rle":
-        rle_d = rle_encode(data, c)
-        comp = zlib.compress(rle_d, level=9)
-        return (len(comp), 1, comp, "rle")
-
-    elif method == "zlib":
-        comp = zlib.compress(data, level=9)
-        return (len(comp), 2, comp, "zlib")
-
-    elif method.startswith("zlib_"):
-        strat_map = {
-            "zlib_default": zlib.Z_DEFAULT_STRATEGY,
-            "zlib_filtered": zlib.Z_FILTERED,
-            "zlib_huffman": zlib.Z_HUFFMAN_ONLY
-        }
-        if method not in strat_map:
-            return (float('inf'), -1, None, method)
+
+# Rows sampled for method prediction: SAMPLE_BANDS evenly spaced bands of
+# SAMPLE_BAND_ROWS rows, so Up/Avg/Paeth still see real vertical context.
+SAMPLE_BANDS = 8
+SAMPLE_BAND_ROWS = 16
+
+def sample_rows(data, w, h, c):
+    """Return (sample, rows) for a strip of evenly spaced row bands."""
+    band = SAMPLE_BAND_ROWS
+    if h <= SAMPLE_BANDS * band:
+        return data, h
+    rows = as_rows(data, w, h, c)
+    starts = np.linspace(0, h - band, SAMPLE_BANDS).astype(int)
+    sample = np.concatenate([rows[s:s + band] for s in starts])
+    return sample.tobytes(), len(sample)
+
+
+def predict_methods(tasks, top_k, executor="auto"):
+    """Keep raw plus the top_k methods that compress a row sample best."""
+    _, data, args = tasks[0]
+    w, h, c = args[:3]
+    sample, sample_h = sample_rows(data, w, h, c)
+    candidates = [task for task in tasks if task[0] != "raw"]
+    if sample is data or len(candidates) <= top_k:
+        return tasks
+    trial = [(method, sample, (w, sample_h, c) + args[3:]) for method, _, _ in candidates]
+    sizes = [r[0] for r in run_tasks(trial, executor)]
+    ranked = sorted(range(len(candidates)), key=lambda i: sizes[i])
+    keep = {candidates[i][0] for i in ranked[:top_k]}
+    return [task for task in tasks if task[0] == "raw" or task[0] in keep]
+
+
+def record_prediction(tasks, results, kept, stats):
+    """Compare the predicted winner with the exhaustive one and store the
+    outcome in stats["prediction"]."""
+    best = min(results, key=lambda x: x[0])
+    predicted = min((r for task, r in zip(tasks, results) if task[0] in kept), key=lambda x: x[0])
+    hit = predicted[3] == best[3]
+    stats["prediction"] = {"hit": hit, "predicted": predicted[3], "best": best[3],
+                           "bytes_lost": predicted[0] - best[0]}
+    if hit:
+        print("Prediction: hit")
+    else:
+        print(f"Prediction: missed ({predicted[3]} instead of {best[3]}, +{predicted[0] - best[0]:,} bytes)")
+
+
+def cache_key(data, w, h, c, settings):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{w}x{h}x{c}:{settings}".encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def cache_digest(head, payload):
+    digest = hashlib.blake2b(head, digest_size=CACHE_DIGEST_SIZE)
+    digest.update(payload)
+    return digest.digest()
+
+
+def cache_get(key, cache_dir=CACHE_DIR):
+    """Return (type, name, payload) for a cached encode, or None. An entry
+    from another cache version, or one that is cut short or corrupted, is
+    deleted and counts as a miss."""
+    path = os.path.join(cache_dir, key + ".pixc")
+    try:
+        with open(path, "rb") as f:
+            entry = f.read()
+    except OSError:
+        return None
+    try:
+        if entry[0] != CACHE_VERSION:
+            raise ValueError("old cache version")
+        t, name_len = entry[1], entry[2]
+        name = entry[3:3 + name_len].decode()
+        pos = 3 + name_len
+        size = int.from_bytes(entry[pos:pos + 8], "little")
+        digest = entry[pos + 8:pos + 8 + CACHE_DIGEST_SIZE]
+        payload = entry[pos + 8 + CACHE_DIGEST_SIZE:]
+        if len(payload) != size or cache_digest(entry[1:pos], payload) != digest:
+            raise ValueError("damaged cache entry")
+    except (IndexError, ValueError):
         try:
-            compressor = zlib.compressobj(level=9, strategy=strat_map[method])
-            comp = compressor.compress(data) + compressor.flush()
-            return (len(comp), 3, comp, method)
-        except Exception:
-            return (float('inf'), -1, None, method)
-
-    elif method == "png_row":
-        comp = png_filter(data, w, h, c)
-        return (len(comp), 6, comp, "png_row")
-
-    elif method == "png_all":
-        return png_filter_all(data, w, h, c)
-
-    elif method == "rle+png_row":
-        rle_d = rle_encode(data, c)
-        comp = png_filter(rle_d, w, h, c)
-        return (len(comp), 8, comp, "rle+png_row")
-
-    elif method == "rle+png_all":
-        rle_d = rle_encode(data, c)
-        return png_filter_all(rle_d, w, h, c)
-
-    elif method == "png_row+zlib":
-        comp = png_filter(data, w, h, c)
-        comp2 = zlib.compress(comp, level=9)
-        return (len(comp2), 9, comp2, "png_row+zlib")
-
-    elif method == "png_all+zlib":
-        _, _, comp, _ = png_filter_all(data, w, h, c)
-        comp2 = zlib.compress(comp, level=9)
-        return (len(comp2), 10, comp2, "png_all+zlib")
-
-    elif method == "palette":
-        pixels = list(Image.frombytes("RGBA" if c == 4 else "RGB", (w, h), data).getdata())
-        unique = len(set(pixels))
-        palette = list(set(pixels))
-        palette_bytes = bytearray()
-        for col in palette:
-            palette_bytes.extend([col[0], col[1], col[2]] + ([col[3]] if c == 4 else []))
-        color_map = {col: i for i, col in enumerate(palette)}
-        indices = bytearray([color_map[p] for p in pixels])
-        pal_data = bytearray([len(palette)]) + palette_bytes + indices
-        comp = zlib.compress(pal_data, level=9)
-        return (len(comp), 5, comp, f"palette_{unique}")
-
-    return (float('inf'), -1, None, "error")
-
-
-
-def save_pix(input_file, output_file):
-    img = Image.open(input_file).convert("RGBA")
-    w, h = img.size
-    pixels = list(img.getdata())
-    use_alpha = has_alpha(pixels)
-    c = 4 if use_alpha else 3
-    data = bytearray()
-    for r, g, b, a in pixels:
-        data.extend([r, g, b] + ([a] if use_alpha else []))
-    tasks = [
-        ("raw", data, (w, h, c)),
-        ("rle", data, (w, h, c)),
-        ("zlib", data, (w, h, c)),
-        ("zlib_default", data, (w, h, c)),
-        ("zlib_filtered", data, (w, h, c)),
-        ("zlib_huffman", data, (w, h, c)),
-        ("png_row", data, (w, h, c)),
-        ("png_all", data, (w, h, c))
-    ]
-    if len(set(pixels)) <= 256:
-        tasks.append(("palette", data, (w, h, c)))
-    with multiprocessing.Pool() as pool:
-        results = pool.map(compress_worker, tasks)
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return t, name, payload
+
+
+def cache_put(key, t, name, payload, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """Store an encode result, then evict least recently used entries until
+    the cache fits in max_bytes. Failures only cost the cache entry."""
+    name = name.encode()[:255]
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, key + ".pixc")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            head = bytes([t, len(name)]) + name
+            f.write(bytes([CACHE_VERSION]) + head)
+            f.write(len(payload).to_bytes(8, "little"))
+            f.write(cache_digest(head, payload))
+            f.write(payload)
+        os.replace(tmp, path)
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".pixc"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, old in sorted(entries):
+            if total <= max_bytes:
+                break
+            os.remove(old)
+            total -= size
+    except OSError:
+        pass
+
+
+def encode_pixels(data, w, h, c, methods, effort, executor, top_k, check_prediction, tile_size, colors, stats=None):
+    """Run the method search and return the smallest (size, type, payload, name), or None.
+
+    If stats is a dict, the prediction and dispatch times, the pool overhead,
+    one entry per method that was run and, with check_prediction, whether
+    the prediction hit are stored in it.
+    """
+    if stats is None:
+        stats = {}
+    tasks = [(m, data, (w, h, c, effort)) for m in palette_methods(methods, colors)]
+    infos = []
+    start = time.perf_counter()
+    if tile_size is not None:
+        ran = []
+        results = [tiled_compress(data, w, h, c, methods, effort, tile_size, executor)]
+    elif top_k is not None:
+        kept = predict_methods(tasks, top_k, executor)
+        stats["predict_s"] = time.perf_counter() - start
+        start = time.perf_counter()
+        ran = tasks if check_prediction else kept
+        results = run_tasks(ran, executor, infos)
+        if check_prediction:
+            record_prediction(tasks, results, {task[0] for task in kept}, stats)
+    else:
+        ran = tasks
+        results = run_tasks(tasks, executor, infos)
+    stats["dispatch_s"] = time.perf_counter() - start
+    for info, r in zip(infos, results):
+        info.update(name=r[3], type=r[1], bytes=r[0] if r[0] != float('inf') else None)
+    stats["methods"] = infos
+    if infos:
+        # Dispatch time not covered by the method work itself, assuming the
+        # workers were kept evenly busy.
+        parallel = 1 if all(i["executor"] == "inline" for i in infos) else min(os.cpu_count() or 1, len(infos))
+        stats["pool_overhead_s"] = max(stats["dispatch_s"] - sum(i["wall_s"] for i in infos) / parallel, 0.0)
+    finished = [(r, task[0]) for task, r in zip(ran, results) if r[0] != float('inf')]
     results = [r for r in results if r[0] != float('inf')]
+    if c in (2, 4) and finished:
+        start = time.perf_counter()
+        split_stats = {}
+        winner = min(finished, key=lambda x: x[0][0])[1]
+        split = encode_split_alpha(data, w, h, c, winner, effort, executor, split_stats)
+        split_stats["total_s"] = time.perf_counter() - start
+        stats["split_alpha"] = split_stats
+        if split is not None:
+            results.append(split)
     results.sort(key=lambda x: x[0])
-    if not results:
-        print("Error: no method succeeded.")
-        return
-    chosen_size, t, chosen, name = results[0]
+    return results[0] if results else None
+
+
+def encode_split_alpha(data, w, h, c, method, effort, executor, stats=None):
+    """Code alpha as its own plane and the color channels with method, the
+    winner of the interleaved search, so no second search is run. Binary
+    alpha becomes a 1-bit mask at any effort; other alpha gets a filtered
+    plane from SPLIT_ALPHA_EFFORT up.
+
+    Returns (size, type | SPLIT_ALPHA, payload, name), or None.
+    """
+    _, level, filters, _ = EFFORT_LEVELS[effort]
+    px = np.frombuffer(data, dtype=np.uint8).reshape(-1, c)
+    alpha = np.ascontiguousarray(px[:, -1])
+    if ((alpha == 0) | (alpha == 255)).all():
+        # A two-entry palette is exactly a row-packed 1-bit mask.
+        alpha_payload, _ = palette_packed_encode(alpha, w, h, 1, level, PALETTE_ORDERS[:1])
+        alpha_type, kind = PALETTE_PACKED, "mask"
+    elif effort >= SPLIT_ALPHA_EFFORT:
+        alpha_payload = png_filter(alpha, w, h, 1, level, filters)
+        alpha_type, kind = PNG_ROW, "plane"
+    else:
+        return None
+    color = np.ascontiguousarray(px[:, :-1])
+    infos = []
+    size, t, payload, name = run_tasks([(method, memoryview(color).cast("B"), (w, h, c - 1, effort))], executor, infos)[0]
+    if stats is not None:
+        for info in infos:
+            info.update(name=name, type=t, bytes=size if size != float('inf') else None)
+        stats["methods"] = infos
+    if payload is None:
+        return None
+    payload = split_alpha_payload(alpha_type, alpha_payload, payload)
+    return (len(payload), t | SPLIT_ALPHA, payload, f"{name}+alpha_{kind}")
+
+
+def save_pix(input_file, output_file, executor="auto", top_k=None, check_prediction=False, effort=MAX_EFFORT, tile_size=None, cache=True, on_stats=None):
+    """Encode input_file with the smallest method and write output_file.
+
+    Returns a dict of timings and per-method results (see encode_pixels),
+    which is also passed to on_stats if given. Returns None if no method
+    succeeded.
+    """
+    total = time.perf_counter()
+    img, use_alpha = read_image(input_file)
+    w, h = img.size
+    c = len(img.getbands())
+    colors = color_count(img) if any(m in PALETTE_LIMITS for m in EFFORT_LEVELS[effort][0]) else None
+    data = img.tobytes()
+    del img
+    return write_pix(data, w, h, c, colors, input_file, output_file, total, executor, top_k,
+                     check_prediction, effort, tile_size, cache, on_stats)
+
+
+def save_pix_array(arr, output_file, executor="auto", top_k=None, effort=MAX_EFFORT, tile_size=None, cache=True, on_stats=None, clear_hidden=False):
+    """Encode an (H, W, C) uint8 array without going through Pillow.
+
+    C is 1 to 4 for L, LA, RGB and RGBA; an (H, W) array is L. The channel
+    count is kept as given, so an RGBA array is always saved with alpha, and
+    every value round-trips unless clear_hidden zeroes the color of fully
+    transparent pixels as save_pix does. Returns the same stats dict as
+    save_pix.
+    """
+    total = time.perf_counter()
+    arr = np.asarray(arr)
+    if arr.ndim == 2:
+        arr = arr[:, :, None]
+    if arr.dtype != np.uint8 or arr.ndim != 3 or not 1 <= arr.shape[2] <= 4:
+        raise ValueError(f"Expected an (H, W, C) uint8 array with 1 to 4 channels, got {arr.shape} {arr.dtype}")
+    h, w, c = arr.shape
+    arr = np.ascontiguousarray(arr)
+    colors = None
+    if any(m in PALETTE_LIMITS for m in EFFORT_LEVELS[effort][0]):
+        limit = max(PALETTE_LIMITS.values())
+        colors = count_colors(arr, limit)
+        colors = colors if colors <= limit else None
+    # The encoders read the array's own memory instead of a bytes copy.
+    data = memoryview(arr).cast("B")
+    return write_pix(data, w, h, c, colors, "<array>", output_file, total, executor, top_k,
+                     False, effort, tile_size, cache, on_stats, clear_hidden)
+
+
+def count_colors(arr, limit):
+    """Number of distinct pixels in an (H, W, C) array, or limit + 1 once
+    there are more than limit of them."""
+    packed = pack_pixels(arr.reshape(-1), arr.shape[2])
+    # A busy image usually shows it in its first rows.
+    if len(np.unique(packed[:limit * 4])) > limit:
+        return limit + 1
+    return min(len(np.unique(packed)), limit + 1)
+
+
+def write_pix(data, w, h, c, colors, input_file, output_file, total, executor="auto", top_k=None, check_prediction=False, effort=MAX_EFFORT, tile_size=None, cache=True, on_stats=None, clear_hidden=True):
+    """Encode raw pixel bytes and write output_file; the shared half of
+    save_pix and save_pix_array. total is when the caller started, and
+    clear_hidden zeroes the color of fully transparent pixels first."""
+    methods, _, _, effort_top_k = EFFORT_LEVELS[effort]
+    if top_k is None:
+        top_k = effort_top_k
+    use_alpha = c in (2, 4)
+    gray = c < 3
+    if clear_hidden:
+        data = clear_transparent(data, c)
+    stats = {"input": input_file, "output": output_file, "width": w, "height": h, "channels": c,
+             "effort": effort, "executor": executor, "ingest_s": time.perf_counter() - total}
+    # check_prediction has to run every method, so it never uses the cache.
+    start = time.perf_counter()
+    key = cache_key(data, w, h, c, (CACHE_VERSION, effort, top_k, tile_size)) if cache and not check_prediction else None
+    hit = cache_get(key) if key else None
+    stats["cache"] = "off" if key is None else "hit" if hit else "miss"
+    stats["cache_s"] = time.perf_counter() - start
+    if hit:
+        t, name, chosen = hit
+        chosen_size = len(chosen)
+    else:
+        best = encode_pixels(data, w, h, c, methods, effort, executor, top_k, check_prediction, tile_size, colors, stats)
+        if best is None:
+            print("Error: no method succeeded.")
+            return
+        chosen_size, t, chosen, name = best
+        if key:
+            cache_put(key, t, name, chosen)
+    start = time.perf_counter()
     with open(output_file, "wb") as f:
-        f.write(b"PX")
-        f.write(w.to_bytes(2, "little"))
-        f.write(h.to_bytes(2, "little"))
-        flags = t | (0x10 if use_alpha else 0x00)
-        f.write(bytes([flags]))
+        write_header(f, w, h, t, use_alpha, effort, gray)
         f.write(chosen)
-    orig = w * h * (4 if use_alpha else 3)
+    orig = w * h * c
     ratio = (orig - chosen_size) / orig * 100
+    stats["write_s"] = time.perf_counter() - start
+    stats["total_s"] = time.perf_counter() - total
+    stats["chosen"] = {"name": name, "type": t, "bytes": chosen_size}
+    stats["ratio"] = ratio
+    if on_stats is not None:
+        on_stats(stats)
     print(f"Saved: {output_file}")
-    print(f"Method: {name} (type={t})")
+    print(f"Method: {name} (type={t}{', cached' if hit else ''})")
+    print(f"Effort: {effort}")
     print(f"Size: {chosen_size:,} bytes")
     print(f"Alpha: {'yes' if use_alpha else 'no'}")
+    print(f"Gray: {'yes' if gray else 'no'}")
     print(f"Ratio: {ratio:.2f}%")
+    return stats
 
 
-# List of all methods that compress_worker can handle
-ALL_METHODS = [
-    "raw", "rle", "zlib", "zlib_default", "zlib_filtered", "zlib_huffman",
-    "png_row", "png_all", "rle+png_row", "rle+png_all", "png_row+zlib",
-    "png_all+zlib", "palette"
+STRIP_ROWS = 64
+
+# Methods stream_save_pix can produce without holding the whole image.
+STREAM_METHODS = [
+    "raw", "rle", "rle_varint", "zlib", "zlib_default", "zlib_filtered", "zlib_huffman",
+    "png_row", "png_all", "png_row+zlib", "png_all+zlib", "tiled"
 ]
 
+
+def png_source_info(path):
+    """Return (width, height, color_type) if path is a PNG that can be read
+    in strips (8-bit, non-interlaced, gray/RGB with or without alpha, no
+    tRNS), otherwise None."""
+    with open(path, "rb") as f:
+        if f.read(8) != b"\x89PNG\r\n\x1a\n":
+            return None
+        f.read(8)
+        ihdr = f.read(13)
+        width = int.from_bytes(ihdr[0:4], "big")
+        height = int.from_bytes(ihdr[4:8], "big")
+        depth, color_type, _, _, interlace = ihdr[8:13]
+        if depth != 8 or color_type not in (0, 2, 4, 6) or interlace:
+            return None
+        f.read(4)
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                return None
+            kind = head[4:8]
+            if kind == b"tRNS":
+                return None
+            if kind in (b"IDAT", b"IEND"):
+                return width, height, color_type
+            f.seek(int.from_bytes(head[0:4], "big") + 4, 1)
+
+
+def png_idat_chunks(f):
+    f.seek(8)
+    while True:
+        head = f.read(8)
+        if len(head) < 8 or head[4:8] == b"IEND":
+            return
+        size = int.from_bytes(head[0:4], "big")
+        if head[4:8] == b"IDAT":
+            while size > 0:
+                chunk = f.read(min(size, 1 << 16))
+                if not chunk:
+                    return
+                size -= len(chunk)
+                yield chunk
+            f.read(4)
+        else:
+            f.seek(size + 4, 1)
+
+
+def png_strips(path, width, color_type, strip_rows):
+    """Yield strips of a PNG as (rows, row_bytes) uint8 arrays in its own
+    channel layout, reading and inflating only one strip at a time."""
+    channels = {0: 1, 2: 3, 4: 2, 6: 4}[color_type]
+    stride = width * channels + 1
+    prev = None
+    with open(path, "rb") as f:
+        for block in records(inflate_chunks(png_idat_chunks(f)), stride * strip_rows):
+            rows = png_unfilter(block, width, len(block) // stride, channels, prev)
+            if not rows:
+                return
+            prev = bytes(rows[-width * channels:])
+            yield np.frombuffer(rows, dtype=np.uint8).reshape(-1, width * channels)
+
+
+def convert_strip(rows, width, source_channels, channels):
+    """Convert a strip between gray, gray+alpha, RGB and RGBA."""
+    px = convert_pixels(np.ascontiguousarray(rows).reshape(-1), source_channels, channels)
+    return np.frombuffer(px, dtype=np.uint8).reshape(len(rows), width, channels)
+
+
+def open_strips(input_file, strip_rows=STRIP_ROWS):
+    """Open a source image for strip-wise reading.
+
+    Returns (width, height, channels, strips), where channels is the
+    smallest layout that holds the image (as in normalize_image) and
+    strips(channels) yields (rows, width, channels) arrays. PNG and PIX
+    sources are read incrementally; a color PNG is checked for gray pixels,
+    and a PNG with an alpha channel for transparency, in one extra pass.
+    Other formats fall back to a full Pillow decode.
+    """
+    if input_file.lower().endswith(".pix"):
+        def pix_strips(channels):
+            with open(input_file, "rb") as f:
+                header = read_header(f)
+                for band in iter_pix_rows(f, header, strip_rows):
+                    rows = np.frombuffer(band, dtype=np.uint8).reshape(-1, header["width"] * source_channels)
+                    yield convert_strip(rows, header["width"], source_channels, channels)
+
+        with open(input_file, "rb") as f:
+            header = read_header(f)
+        source_channels = header_channels(header)
+        return header["width"], header["height"], source_channels, pix_strips
+
+    info = png_source_info(input_file)
+    if info is not None:
+        width, height, color_type = info
+        source_channels = {0: 1, 2: 3, 4: 2, 6: 4}[color_type]
+
+        def strips(channels):
+            for rows in png_strips(input_file, width, color_type, strip_rows):
+                yield convert_strip(rows, width, source_channels, channels)
+
+        use_alpha = False
+        gray = True
+        check_alpha, check_gray = color_type in (4, 6), color_type in (2, 6)
+        if check_alpha or check_gray:
+            for rows in png_strips(input_file, width, color_type, strip_rows):
+                px = rows.reshape(len(rows), width, source_channels)
+                use_alpha = use_alpha or (check_alpha and bool(px[:, :, -1].min() != 255))
+                gray = gray and (not check_gray or is_gray(px))
+                if (use_alpha or not check_alpha) and (not gray or not check_gray):
+                    break
+        return width, height, (1 if gray else 3) + use_alpha, strips
+
+    img, _ = read_image(input_file)
+    width, height = img.size
+
+    def pillow_strips(channels):
+        for y in range(0, height, strip_rows):
+            strip = img.crop((0, y, width, min(height, y + strip_rows)))
+            yield np.frombuffer(strip.tobytes(), dtype=np.uint8).reshape(-1, width, channels)
+
+    return width, height, len(img.getbands()), pillow_strips
+
+
+def stream_compress(out, strips, w, h, c, method, effort):
+    """Compress strips straight into out. Returns (type, payload size)."""
+    _, level, filters, _ = EFFORT_LEVELS[effort]
+    start = out.tell()
+
+    if method == "raw":
+        for strip in strips:
+            out.write(strip)
+        return RAW, out.tell() - start
+
+    if method in ("rle", "rle_varint", "zlib") or method in ZLIB_STRATEGIES:
+        if method in ZLIB_STRATEGIES:
+            compressor = zlib.compressobj(level=level, strategy=ZLIB_STRATEGIES[method])
+        else:
+            compressor = zlib.compressobj(level=level)
+        for strip in strips:
+            # Runs simply restart at strip boundaries.
+            if method == "rle":
+                data = rle_encode(strip.tobytes(), c)
+            elif method == "rle_varint":
+                data = rle_varint_encode(strip.tobytes(), c)
+            else:
+                data = strip
+            out.write(compressor.compress(data))
+        out.write(compressor.flush())
+        t = {"rle": RLE, "zlib": ZLIB, "rle_varint": RLE_VARINT}.get(method, ZLIB_STRATEGY)
+        return t, out.tell() - start
+
+    if method in ("png_row", "png_row+zlib"):
+        compressors = [zlib.compressobj(level=level)]
+        if method == "png_row+zlib":
+            compressors.append(zlib.compressobj(level=level))
+
+        def emit(data):
+            for compressor in compressors:
+                data = compressor.compress(data)
+            out.write(data)
+
+        prev = np.zeros(w * c, dtype=np.uint8)
+        first = True
+        for strip in strips:
+            rows = strip.reshape(-1, w * c)
+            emit(pick_row_filters(filter_rows(rows, prev, c), first, w, filters))
+            prev = rows[-1]
+            first = False
+        data = compressors[0].flush()
+        if len(compressors) == 2:
+            data = compressors[1].compress(data) + compressors[1].flush()
+        out.write(data)
+        return (PNG_ROW if method == "png_row" else PNG_ROW_ZLIB), out.tell() - start
+
+    if method in ("png_all", "png_all+zlib"):
+        # Every filter gets its own spooled stream; the smallest is copied out.
+        compressors = {f: zlib.compressobj(level=level) for f in filters}
+        spools = {f: tempfile.TemporaryFile() for f in filters}
+        try:
+            prev = np.zeros(w * c, dtype=np.uint8)
+            for strip in strips:
+                rows = strip.reshape(-1, w * c)
+                filtered = filter_rows(rows, prev, c)
+                block = np.empty((len(rows), w * c + 1), dtype=np.uint8)
+                for f in filters:
+                    block[:, 0] = f
+                    block[:, 1:] = filtered[f]
+                    spools[f].write(compressors[f].compress(block))
+                prev = rows[-1]
+            for f in filters:
+                spools[f].write(compressors[f].flush())
+            best = min(filters, key=lambda f: spools[f].tell())
+            spool = spools[best]
+            spool.seek(0)
+            outer = zlib.compressobj(level=level) if method == "png_all+zlib" else None
+            for chunk in iter(lambda: spool.read(1 << 20), b""):
+                out.write(outer.compress(chunk) if outer else chunk)
+            if outer:
+                out.write(outer.flush())
+        finally:
+            for spool in spools.values():
+                spool.close()
+        return (PNG_ALL if method == "png_all" else PNG_ALL_ZLIB), out.tell() - start
+
+    raise ValueError(f"Method {method} cannot be streamed")
+
+
+def stream_tiled(out, strips, w, h, c, effort, tile_size):
+    """Write a tiled payload one row of tiles at a time.
+
+    The tile table is reserved up front and filled in at the end.
+    """
+    methods = ["raw"] + [m for m in EFFORT_LEVELS[effort][0] if m != "raw"]
+    start = out.tell()
+    count = len(tile_boxes(w, h, tile_size))
+    out.write(tile_table_head(tile_size, tile_size, count))
+    table_pos = out.tell()
+    out.write(bytes(TILE_ENTRY * count))
+    data_pos = out.tell()
+    table = bytearray()
+    for strip in strips:
+        data = strip.tobytes()
+        th = len(strip)
+        for x, _, tw, _ in tile_boxes(w, th, tile_size):
+            t, comp = compress_tile(data, w, th, c, (x, 0, tw, th), methods, effort)
+            table += pack_tile_entry(t, out.tell() - data_pos, len(comp))
+            out.write(comp)
+    end = out.tell()
+    out.seek(table_pos)
+    out.write(table)
+    out.seek(end)
+    return TILED, end - start
+
+
+def stream_save_pix(input_file, output_file, method="png_row", effort=MAX_EFFORT, strip_rows=STRIP_ROWS, tile_size=TILE_SIZE):
+    """Encode an image strip by strip so memory depends on the strip size.
+
+    Each strip is filtered with only the previous row as context and pushed
+    through zlib incrementally. PNG and PIX inputs are never fully loaded;
+    see open_strips for other formats.
+    """
+    if method not in STREAM_METHODS:
+        raise ValueError(f"Method {method} cannot be streamed; use one of {', '.join(STREAM_METHODS)}")
+    if method == "tiled":
+        strip_rows = tile_size
+    w, h, c, strips = open_strips(input_file, strip_rows)
+    use_alpha, gray = c in (2, 4), c < 3
+    source = strips
+
+    def strips(channels):
+        for strip in source(channels):
+            yield np.frombuffer(clear_transparent(strip.reshape(-1), channels), dtype=np.uint8).reshape(strip.shape)
+    with open(output_file, "wb") as f:
+        write_header(f, w, h, RAW, use_alpha, effort, gray)
+        if method == "tiled":
+            t, size = stream_tiled(f, strips(c), w, h, c, effort, tile_size)
+        else:
+            t, size = stream_compress(f, strips(c), w, h, c, method, effort)
+        # The header was written before the type was final.
+        f.seek(0)
+        write_header(f, w, h, t, use_alpha, effort, gray)
+    orig = w * h * c
+    ratio = (orig - size) / orig * 100 if orig else 0
+    print(f"Saved: {output_file}")
+    print(f"Method: {method} (type={t}, streamed)")
+    print(f"Effort: {effort}")
+    print(f"Size: {size:,} bytes")
+    print(f"Alpha: {'yes' if use_alpha else 'no'}")
+    print(f"Gray: {'yes' if gray else 'no'}")
+    print(f"Ratio: {ratio:.2f}%")
+
+
+# List of all methods that compress_worker can handle
+ALL_METHODS = list(ENCODERS)
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python to_pix.py input.png output.pix [--scm METHOD] [--list]")
+        print("Usage: python to_pix.py input.png output.pix [--scm METHOD] [--executor auto|inline|thread|process] [--effort 0-9] [--top-k K [--check-prediction]] [--tile SIZE] [--stream METHOD] [--no-cache] [--stats json] [--list]")
         sys.exit(1)
 
     if "--list" in sys.argv:
@@ -283,7 +932,54 @@ if __name__ == "__main__":
     input_file = sys.argv[1]
     output_file = sys.argv[2]
 
-    if "--scm" in sys.argv:
+    executor = "auto"
+    if "--executor" in sys.argv:
+        idx = sys.argv.index("--executor")
+        if idx + 1 >= len(sys.argv) or sys.argv[idx + 1] not in EXECUTORS:
+            print(f"Error: --executor must be one of {', '.join(EXECUTORS)}")
+            sys.exit(1)
+        executor = sys.argv[idx + 1]
+
+    top_k = None
+    if "--top-k" in sys.argv:
+        idx = sys.argv.index("--top-k")
+        if idx + 1 >= len(sys.argv) or not sys.argv[idx + 1].isdigit() or int(sys.argv[idx + 1]) < 1:
+            print("Error: --top-k requires a positive number")
+            sys.exit(1)
+        top_k = int(sys.argv[idx + 1])
+    check_prediction = "--check-prediction" in sys.argv
+
+    effort = MAX_EFFORT
+    if "--effort" in sys.argv:
+        idx = sys.argv.index("--effort")
+        if idx + 1 >= len(sys.argv) or not sys.argv[idx + 1].isdigit() or int(sys.argv[idx + 1]) not in EFFORT_LEVELS:
+            print(f"Error: --effort must be between 0 and {MAX_EFFORT}")
+            sys.exit(1)
+        effort = int(sys.argv[idx + 1])
+
+    tile_size = None
+    if "--tile" in sys.argv:
+        idx = sys.argv.index("--tile")
+        if idx + 1 >= len(sys.argv) or not sys.argv[idx + 1].isdigit() or not 1 <= int(sys.argv[idx + 1]) <= 65535:
+            print("Error: --tile requires a tile size between 1 and 65535")
+            sys.exit(1)
+        tile_size = int(sys.argv[idx + 1])
+
+    stats_format = None
+    if "--stats" in sys.argv:
+        idx = sys.argv.index("--stats")
+        if idx + 1 >= len(sys.argv) or sys.argv[idx + 1] != "json":
+            print("Error: --stats requires a format (json)")
+            sys.exit(1)
+        stats_format = sys.argv[idx + 1]
+
+    if "--stream" in sys.argv:
+        idx = sys.argv.index("--stream")
+        if idx + 1 >= len(sys.argv) or sys.argv[idx + 1] not in STREAM_METHODS:
+            print(f"Error: --stream requires one of {', '.join(STREAM_METHODS)}")
+            sys.exit(1)
+        stream_save_pix(input_file, output_file, sys.argv[idx + 1], effort, tile_size=tile_size or TILE_SIZE)
+    elif "--scm" in sys.argv:
         idx = sys.argv.index("--scm")
         if idx + 1 >= len(sys.argv):
             print("Error: --scm flag requires a method name")
@@ -295,34 +991,37 @@ if __name__ == "__main__":
             sys.exit(1)
 
         # Load image and build data
-        img = Image.open(input_file).convert("RGBA")
+        img, use_alpha = read_image(input_file)
         w, h = img.size
-        pixels = list(img.getdata())
-        use_alpha = has_alpha(pixels)
-        c = 4 if use_alpha else 3
-        data = bytearray()
-        for r, g, b, a in pixels:
-            data.extend([r, g, b] + ([a] if use_alpha else []))
+        c = len(img.getbands())
+        gray = c < 3
+        data = clear_transparent(img.tobytes(), c)
+        del img
 
         # Run chosen method
-        size, t, comp, name = compress_worker((method_name, data, (w, h, c)))
+        size, t, comp, name = compress_worker((method_name, data, (w, h, c, effort)))
         if size == float("inf"):
             print(f"Error: method {method_name} failed.")
             sys.exit(1)
 
         with open(output_file, "wb") as f:
-            f.write(b"PX")
-            f.write(w.to_bytes(2, "little"))
-            f.write(h.to_bytes(2, "little"))
-            flags = t | (0x08 if use_alpha else 0x00)
-            f.write(bytes([flags]))
+            write_header(f, w, h, t, use_alpha, effort, gray)
             f.write(comp)
-        orig = w * h * (4 if use_alpha else 3)
+        orig = w * h * c
         ratio = (orig - size) / orig * 100
         print(f"Saved: {output_file}")
         print(f"Method: {name} (type={t})")
+        print(f"Effort: {effort}")
         print(f"Size: {size:,} bytes")
         print(f"Alpha: {'yes' if use_alpha else 'no'}")
+        print(f"Gray: {'yes' if gray else 'no'}")
         print(f"Ratio: {ratio:.2f}%")
+    elif stats_format == "json":
+        # The usual summary goes to stderr so stdout holds only the JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            stats = save_pix(input_file, output_file, executor, top_k, check_prediction, effort, tile_size, "--no-cache" not in sys.argv)
+        print(json.dumps(stats))
+        if stats is None:
+            sys.exit(1)
     else:
-        save_pix(input_file, output_file)
+        save_pix(input_file, output_file, executor, top_k, check_prediction, effort, tile_size, "--no-cache" not in sys.argv)
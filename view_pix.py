@@ -1,227 +1,26 @@
 # Viewer
 
-from PIL import Image
-import sys, zlib, os, time, tempfile, subprocess
-
-def run_length_decode(data, channels, pixel_count):
-    """Decode RLE data back to pixels"""
-    result = bytearray()
-    i = 0
-    pixels_decoded = 0
-    
-    while i < len(data) and pixels_decoded < pixel_count:
-        run_length = data[i]
-        i += 1
-        pixel_data = data[i:i+channels]
-        i += channels
-        
-        for _ in range(run_length):
-            result.extend(pixel_data)
-            pixels_decoded += 1
-            if pixels_decoded >= pixel_count:
-                break
-    
-    return result
-
-def png_filter_decode_fast(compressed_data, width, height, channels):
-    """Fast PNG-style filter decoder for viewer"""
-    filtered_data = zlib.decompress(compressed_data)
-    pixel_bytes = bytearray()
-    bytes_per_row = width * channels
-    filtered_pos = 0
-    
-    for row in range(height):
-        if filtered_pos >= len(filtered_data):
-            break
-            
-        filter_type = filtered_data[filtered_pos]
-        filtered_pos += 1
-        row_data = filtered_data[filtered_pos:filtered_pos + bytes_per_row]
-        filtered_pos += bytes_per_row
-        
-        if len(row_data) < bytes_per_row:
-            row_data = row_data + bytearray([0] * (bytes_per_row - len(row_data)))
-        
-        reconstructed_row = bytearray()
-        
-        if filter_type == 0:  # None
-            reconstructed_row = row_data
-        elif filter_type == 1:  # Sub
-            for i in range(len(row_data)):
-                if i < channels:
-                    reconstructed_row.append(row_data[i])
-                else:
-                    left = reconstructed_row[i - channels]
-                    reconstructed_row.append((row_data[i] + left) % 256)
-        elif filter_type == 2:  # Up
-            if row > 0:
-                prev_row_start = (row - 1) * bytes_per_row
-                prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-                for i in range(len(row_data)):
-                    up = prev_row[i] if i < len(prev_row) else 0
-                    reconstructed_row.append((row_data[i] + up) % 256)
-            else:
-                reconstructed_row = row_data
-        elif filter_type == 3:  # Average
-            prev_row = bytearray()
-            if row > 0:
-                prev_row_start = (row - 1) * bytes_per_row
-                prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-            for i in range(len(row_data)):
-                left = reconstructed_row[i - channels] if i >= channels else 0
-                up = prev_row[i] if i < len(prev_row) else 0
-                avg = (left + up) // 2
-                reconstructed_row.append((row_data[i] + avg) % 256)
-        elif filter_type == 4:  # Paeth
-            prev_row = bytearray()
-            if row > 0:
-                prev_row_start = (row - 1) * bytes_per_row
-                prev_row = pixel_bytes[prev_row_start:prev_row_start + bytes_per_row]
-            for i in range(len(row_data)):
-                left = reconstructed_row[i - channels] if i >= channels else 0
-                up = prev_row[i] if i < len(prev_row) else 0
-                up_left = prev_row[i - channels] if i >= channels and i < len(prev_row) else 0
-                
-                p = left + up - up_left
-                pa = abs(p - left)
-                pb = abs(p - up)
-                pc = abs(p - up_left)
-                
-                if pa <= pb and pa <= pc:
-                    pred = left
-                elif pb <= pc:
-                    pred = up
-                else:
-                    pred = up_left
-                    
-                reconstructed_row.append((row_data[i] + pred) % 256)
-        else:
-            reconstructed_row = row_data
-        
-        pixel_bytes.extend(reconstructed_row)
-    
-    return pixel_bytes
+import sys, os, time, tempfile, subprocess
+from pix_codec import read_header, header_channels, decode_pixels, pixels_to_image, MODES
+from from_pix import load_pix_region
 
 def fast_load_pix(filename):
     with open(filename, "rb") as f:
-        header = f.read(7)
-        if header[:2] != b"PX":
-            raise ValueError("Not a pix file")
+        header = read_header(f)
+        width = header["width"]
+        height = header["height"]
+        compression = header["compression"]
+        channels = header_channels(header)
 
-        width = int.from_bytes(header[2:4], "little")
-        height = int.from_bytes(header[4:6], "little")
-        flags = header[6]
-        
-        compression = flags & 0x0F
-        has_alpha = bool(flags & 0x10)
-        pixel_count = width * height
-        channels = 4 if has_alpha else 3
-
-        print(f"Loading {width}x{height} {'RGBA' if has_alpha else 'RGB'} image (compression={compression})")
+        effort = f", effort={header['effort']}" if header["effort"] is not None else ""
+        print(f"Loading {width}x{height} {MODES[channels]} image (compression={compression}{effort})")
 
         compressed_data = f.read()
-        
-        if compression == 0:  # Raw
-            if has_alpha:
-                pixels = [tuple(compressed_data[i:i+4]) for i in range(0, len(compressed_data), 4)]
-            else:
-                pixels = [tuple(compressed_data[i:i+3]) + (255,) for i in range(0, len(compressed_data), 3)]
 
-        elif compression == 1:  # RLE
-            decompressed = zlib.decompress(compressed_data)
-            raw_bytes = run_length_decode(decompressed, channels, pixel_count)
-            if has_alpha:
-                pixels = [tuple(raw_bytes[i:i+4]) for i in range(0, len(raw_bytes), 4)]
-            else:
-                pixels = [tuple(raw_bytes[i:i+3]) + (255,) for i in range(0, len(raw_bytes), 3)]
+    raw_bytes = decode_pixels(compression, compressed_data, width, height, channels)
+    return pixels_to_image(raw_bytes, width, height, channels)
 
-        elif compression in [2, 3]:  # Zlib variants
-            raw_bytes = zlib.decompress(compressed_data)
-            if has_alpha:
-                pixels = [tuple(raw_bytes[i:i+4]) for i in range(0, len(raw_bytes), 4)]
-            else:
-                pixels = [tuple(raw_bytes[i:i+3]) + (255,) for i in range(0, len(raw_bytes), 3)]
-
-        elif compression == 4:  # Simple delta prediction (unused in to_pix.py)
-            delta_bytes = zlib.decompress(compressed_data)
-            
-            if has_alpha:
-                pixels = []
-                prev = [0, 0, 0, 0]
-                for i in range(0, len(delta_bytes), 4):
-                    prev[0] = (delta_bytes[i] + prev[0]) & 255
-                    prev[1] = (delta_bytes[i+1] + prev[1]) & 255
-                    prev[2] = (delta_bytes[i+2] + prev[2]) & 255
-                    prev[3] = (delta_bytes[i+3] + prev[3]) & 255
-                    pixels.append(tuple(prev))
-            else:
-                pixels = []
-                prev = [0, 0, 0]
-                for i in range(0, len(delta_bytes), 3):
-                    prev[0] = (delta_bytes[i] + prev[0]) & 255
-                    prev[1] = (delta_bytes[i+1] + prev[1]) & 255
-                    prev[2] = (delta_bytes[i+2] + prev[2]) & 255
-                    pixels.append(tuple(prev) + (255,))
-
-        elif compression == 5:  # Palette
-            decompressed = zlib.decompress(compressed_data)
-            palette_size = decompressed[0]
-            
-            palette = []
-            for i in range(palette_size):
-                start = 1 + i * channels
-                pixel = tuple(decompressed[start:start+channels])
-                if not has_alpha:
-                    pixel += (255,)
-                palette.append(pixel)
-            
-            indices_start = 1 + palette_size * channels
-            pixels = [palette[decompressed[i]] for i in range(indices_start, min(len(decompressed), indices_start + pixel_count))]
-
-        elif compression == 6:  # PNG-style filtering
-            raw_bytes = png_filter_decode_fast(compressed_data, width, height, channels)
-            
-            if has_alpha:
-                pixels = [tuple(raw_bytes[i:i+4]) for i in range(0, len(raw_bytes), 4)]
-            else:
-                pixels = [tuple(raw_bytes[i:i+3]) + (255,) for i in range(0, len(raw_bytes), 3)]
-
-        elif compression == 7:  # PNG filter all methods
-            raw_bytes = png_filter_decode_fast(compressed_data, width, height, channels)
-            
-            if has_alpha:
-                pixels = [tuple(raw_bytes[i:i+4]) for i in range(0, len(raw_bytes), 4)]
-            else:
-                pixels = [tuple(raw_bytes[i:i+3]) + (255,) for i in range(0, len(raw_bytes), 3)]
-
-        elif compression in [8, 9, 10]:  # RLE+PNG combinations and PNG+zlib combinations
-            # These are double-compressed, decompress outer layer first
-            if compression in [9, 10]:  # PNG+zlib combinations
-                compressed_data = zlib.decompress(compressed_data)
-            
-            if compression in [8]:  # RLE+PNG
-                # First decode as PNG filter
-                raw_bytes = png_filter_decode_fast(compressed_data, width, height, channels)
-                # Then decode RLE
-                raw_bytes = run_length_decode(raw_bytes, channels, pixel_count)
-            else:  # PNG combinations
-                raw_bytes = png_filter_decode_fast(compressed_data, width, height, channels)
-            
-            if has_alpha:
-                pixels = [tuple(raw_bytes[i:i+4]) for i in range(0, len(raw_bytes), 4)]
-            else:
-                pixels = [tuple(raw_bytes[i:i+3]) + (255,) for i in range(0, len(raw_bytes), 3)]
-
-        else:
-            raise ValueError(f"Unsupported compression type: {compression}")
-
-        pixels = pixels[:pixel_count]  
-        while len(pixels) < pixel_count:  
-            pixels.append((0, 0, 0, 255))
-
-    return pixels, width, height
-
-def view_pix(filename, show_info=False):
+def view_pix(filename, show_info=False, region=None):
     if not os.path.exists(filename):
         print(f"Error: File '{filename}' not found")
         return
@@ -229,11 +28,14 @@ def view_pix(filename, show_info=False):
     try:
         start_time = time.time()
         
-        pixels, width, height = fast_load_pix(filename)
-        load_time = time.time() - start_time
-        
-        img = Image.new("RGBA", (width, height))
-        img.putdata(pixels)
+        if region:
+            img = load_pix_region(filename, region)
+            width, height = img.size
+            load_time = time.time() - start_time
+        else:
+            img = fast_load_pix(filename)
+            width, height = img.size
+            load_time = time.time() - start_time
         
         total_time = time.time() - start_time
         
@@ -243,6 +45,9 @@ def view_pix(filename, show_info=False):
             print(f"File: {os.path.basename(filename)}")
             print(f"Size: {file_size:,} bytes")
             print(f"Dimensions: {width}x{height} ({pixel_count:,} pixels)")
+            with open(filename, "rb") as f:
+                effort = read_header(f)["effort"]
+            print(f"Effort: {effort if effort is not None else 'unknown'}")
             print(f"Load time: {load_time:.3f}s")
             print(f"Total time: {total_time:.3f}s")
             print(f"Speed: {pixel_count/total_time:,.0f} pixels/second")
@@ -278,17 +83,28 @@ if __name__ == "__main__":
         print("  python view_pix.py image.pix              # View single image")
         print("  python view_pix.py *.pix                  # View multiple images")
         print("  python view_pix.py image.pix --info       # Show detailed info")
+        print("  python view_pix.py image.pix --region X0,Y0,X1,Y1  # View part of an image")
     else:
         filenames = []
         show_info = False
+        region = None
         
-        for arg in sys.argv[1:]:
+        args = iter(sys.argv[1:])
+        for arg in args:
             if arg == "--info":
                 show_info = True
+            elif arg == "--region":
+                try:
+                    region = tuple(int(v) for v in next(args).split(","))
+                    if len(region) != 4:
+                        raise ValueError
+                except (StopIteration, ValueError):
+                    print("Error: --region needs X0,Y0,X1,Y1")
+                    sys.exit(1)
             else:
                 filenames.append(arg)
         
         if len(filenames) == 1:
-            view_pix(filenames[0], show_info)
+            view_pix(filenames[0], show_info, region)
         else:
             batch_view_pix(filenames)
\ No newline at end of file